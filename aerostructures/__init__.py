@@ -5,7 +5,13 @@ from aerostructures.number_formatting.nastran_pch_reader import PchParser
 from aerostructures.data_transfer.displacement_transfer import DisplacementTransfer
 from aerostructures.data_transfer.interpolation import Interpolation
 from aerostructures.data_transfer.load_transfer import LoadTransfer
-from aerostructures.data_transfer.rbf_poly_bias import Rbf_poly_bias
+from aerostructures.data_transfer.rbf_poly_bias import Rbf_poly_bias, SparseRbfOperator, KrylovRbfOperator
+from aerostructures.data_transfer.rbf_partition_unity import Rbf_partition_unity
+from aerostructures.data_transfer.rbf_surfaces import Rbf_surfaces
+from aerostructures.data_transfer.element_projection import ElementProjection
+from aerostructures.data_transfer.block_low_rank import BlockLowRankOperator
+from aerostructures.data_transfer.out_of_core import OutOfCoreMatrix
+from aerostructures.data_transfer.transfer_products import batch_dot, batch_outer
 from aerostructures.data_transfer.mode_transfer import ModeTransfer
 
 from aerostructures.aerodynamics.aerodynamics_problem_dimensions import AeroProblemDimensions
@@ -27,6 +33,8 @@ from aerostructures.solvers.nl_gauss_seidel import NLGaussSeidel
 
 from aerostructures.openmdao_tools.mixed_input_des_var_t import MixedInputDesvarT
 from aerostructures.openmdao_tools.mixed_input_des_var_m import MixedInputDesvarM
+from aerostructures.openmdao_tools.memoization import MemoizationMixin
+from aerostructures.openmdao_tools.wait_for_output import wait_for_output
 
 from aerostructures.geometry.panair_mesher import PanairMesher
 from aerostructures.geometry.planform_geometry import PlanformGeometry
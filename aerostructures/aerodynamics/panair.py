@@ -8,6 +8,8 @@ from openmdao.api import Component
 
 import numpy as np
 
+from scipy import sparse
+
 import os.path
 
 import os
@@ -18,10 +20,10 @@ import sys
 
 from subprocess import Popen, PIPE
 
-import math
-
 from aerostructures.number_formatting.is_number import isfloat, isint
 
+from aerostructures.openmdao_tools.wait_for_output import wait_for_output
+
 class Panair(Component):
     aero_template = 'aero_template.wgs'
 
@@ -29,6 +31,12 @@ class Panair(Component):
 
     aux_panin = 'aux_panin.aux'
 
+    #Maximum time (s) to wait for the output file of Panair to be completed
+    output_timeout = 3600.
+
+    #Time (s) without changes of the output file before reading it (0: Panair has already exited, so the file is complete)
+    output_settle = 0.
+
 
     def __init__(self, na, network_info, case_name, sym_plane_index=None):
         super(Panair, self).__init__()
@@ -39,6 +47,9 @@ class Panair(Component):
         #List containing information about each network (network ID, shape and number of points and panels of preceeding networks)
         self.network_info = network_info
 
+        #Distribution matrix of the panel force coefficients over the aerodynamic grid points
+        self.pan_to_point = self.get_pan_to_point()
+
         #Symmetry plane index
         self.sym_plane_index = sym_plane_index
 
@@ -108,8 +119,10 @@ class Panair(Component):
         # Run Panair
         os.chdir(case_name)
         p = Popen('panair '+self.input_filepath)
-        p.wait()
+        return_code = p.wait()
         os.chdir('..')
+        if return_code != 0:
+            raise RuntimeError("Panair failed with return code " + str(return_code))
 
         #Get output data from the Panair output file
         output_data = self.get_output_data()
@@ -261,68 +274,50 @@ class Panair(Component):
 
     def get_forces(self, params, pan_cp):
 
-        f_a = np.zeros((self.na, 3))
-
-        pan_cp_nw = []
-        point_cf_nw = []
+        #Pressure coefficient and normal vector (normalized by Spanel/Sref) of each panel
+        pan_cp = np.asarray(pan_cp, dtype=float).reshape(-1, 4)[:self.pan_to_point.shape[1]]
 
-        #Get network information
-        network_info = self.network_info
+        #Force coefficient components of each panel
+        pan_cf = -pan_cp[:, :1]*pan_cp[:, 1:]
 
-        #Create a list with the Cp results of each network
-        for n in network_info:
-            pan_cp_nw.append(pan_cp[n[4]:int(n[4]+(n[1]-1)*(n[2]-1))])
-            point_cf_nw.append(f_a[n[3]:int(n[3]+n[1]*n[2])])
-
-        #Compute the force coefficient for each panel on each network and distribute it over the vertices of the panel
-        for n in pan_cp_nw:
-            for p in n:
-                #Index of the panel within a network (starting by 1)
-                ip = n.index(p) + 1
+        #Get the reference wing area, airspeed and density
+        Sw = params['Sw']
+        V = params['V']
+        rho_a = params['rho_a']
 
-                #Index of the current network
-                ni = pan_cp_nw.index(n)
+        #Distribute the force coefficients over the vertices of the panels and dimensionalize to obtain force values
+        f_a = 0.5*rho_a*V**2*Sw*self.pan_to_point.dot(pan_cf)
 
-                #Number of rows of the network
-                nm = network_info[ni][1]
+        return f_a
 
-                #Indices of panel vertices within a network (starting by 1)
-                if ip % (nm - 1) == 0:
-                    i1 = ip + ip/(nm - 1) -1
-                else:
-                    i1 = ip + math.floor(ip/(nm - 1))
+    #Sparse matrix that distributes evenly the value of each panel over its 4 vertices
+    def get_pan_to_point(self):
 
-                i2 = i1 + nm
-                i3 = i1 + nm + 1
-                i4 = i1 + 1
+        rows = []
+        cols = []
 
-                #Indices of panel vertices within a network (starting by 0)
-                i1 = int(i1 - 1)
-                i2 = int(i2 - 1)
-                i3 = int(i3 - 1)
-                i4 = int(i4 - 1)
+        for n in self.network_info:
+            #Number of rows and columns of points of the network
+            nm = n[1]
+            nn = n[2]
 
-                #Pressure and force coefficient components of the panel
-                cp = p[0]
-                cfx = -cp*p[1]
-                cfy = -cp*p[2]
-                cfz = -cp*p[3]
+            #Column and row of each panel within the network (panels are numbered by columns)
+            c, r = np.divmod(np.arange((nm - 1)*(nn - 1)), nm - 1)
 
-                #Distribute evenly the force coefficients over the 4 vertices of the panel
-                point_cf_nw[ni][i1] = point_cf_nw[ni][i1] + [cfx/4, cfy/4, cfz/4]
-                point_cf_nw[ni][i2] = point_cf_nw[ni][i2] + [cfx/4, cfy/4, cfz/4]
-                point_cf_nw[ni][i3] = point_cf_nw[ni][i3] + [cfx/4, cfy/4, cfz/4]
-                point_cf_nw[ni][i4] = point_cf_nw[ni][i4] + [cfx/4, cfy/4, cfz/4]
+            #Indices of panel vertices within the network
+            i1 = c*nm + r
+            i2 = i1 + nm
+            i3 = i1 + nm + 1
+            i4 = i1 + 1
 
-        #Get the reference wing area, airspeed and density
-        Sw = self.params['Sw']
-        V = self.params['V']
-        rho_a = self.params['rho_a']
+            rows.append(n[3] + np.hstack((i1, i2, i3, i4)))
+            cols.append(n[4] + np.tile(np.arange((nm - 1)*(nn - 1)), 4))
 
-        #Store the force coefficients components as an array and dimensionalize to obtain force values
-        f_a = 0.5*rho_a*V**2*Sw*np.vstack(point_cf_nw)
+        rows = np.hstack(rows)
+        cols = np.hstack(cols)
+        n_pan = int(sum([(n[1] - 1)*(n[2] - 1) for n in self.network_info]))
 
-        return f_a
+        return sparse.csr_matrix((np.full(len(rows), 0.25), (rows, cols)), shape=(self.na, n_pan))
 
     #Function that returns panel Cp and its unit normal vector normalized by Spanel/Sref
     def get_output_data(self):
@@ -331,32 +326,12 @@ class Panair(Component):
         output_filepath = os.path.join(os.getcwd(), case_name, self.output_filepath)
         input_filepath = os.path.join(os.getcwd(), case_name, self.input_filepath)
 
-        pan_cp = []
-
         #Read the output file only if it exists and its last modification date is older than input file one
-        while(not os.path.isfile(output_filepath)): pass
-
-        while(os.path.getmtime(output_filepath) <= os.path.getmtime(input_filepath)): pass
+        wait_for_output(output_filepath, input_filepath, timeout=self.output_timeout, settle=self.output_settle)
 
         #Read the output file and store Cp and normal vector components
         with open(output_filepath) as f:
-            lines = f.readlines()
-            lines = [i.split() for i in lines]
-            results_begin = lines.index(['0*b*solution'])
-            results_end = lines.index(['full', 'configuration', 'forces', 'and', 'moments', 'summary'])
-
-            for line in lines:
-                #Get panel pressure coefficients
-                if len(line) > 1 and lines.index(line) > results_begin and lines.index(line) < results_end and len(lines[lines.index(line)-1]) == 0:
-                    if isint(line[0]) and isint(line[1]):
-                       pan_cp.append([float(lines[lines.index(line)+1][10]), float(line[10]), float(line[11]), float(line[12])])
-
-                #Get full configuration lift and induced drag coefficients
-                if len(line) > 2:
-                    if line[0] == 'full' and line[1] == 'configuration' and line[2] == 'forces':
-                        i = lines.index(line)
-                        CL = lines[i+11][3]
-                        CDi = lines[i+11][4]
+            pan_cp, CL, CDi = self.read_output(f)
 
         output_data = {}
 
@@ -365,3 +340,58 @@ class Panair(Component):
         output_data['CDi'] = CDi
 
         return output_data
+
+    #Single pass over the lines of the Panair output file, which stops once the lift and induced drag coefficients are read
+    def read_output(self, f):
+
+        #Cp and normal vector components of each panel
+        pan_cp = np.zeros((self.pan_to_point.shape[1], 4))
+        n_pan = 0
+
+        CL = None
+        CDi = None
+
+        #Part of the file being read: before the solution ('header'), solution ('solution') or forces and moments summary ('summary')
+        state = 'header'
+        blank = False
+        panel = False
+        summary_line = 0
+
+        for line in f:
+            line = line.split()
+
+            if state == 'header':
+                if line == ['0*b*solution']:
+                    state = 'solution'
+
+            elif state == 'solution':
+                #Get full configuration lift and induced drag coefficients, 11 lines below the summary title
+                if len(line) > 2 and line[0] == 'full' and line[1] == 'configuration' and line[2] == 'forces':
+                    state = 'summary'
+
+                #Get the panel pressure coefficient from the line after the panel normal vector
+                elif panel:
+                    pan_cp[n_pan, 0] = float(line[10])
+                    n_pan += 1
+                    panel = False
+
+                #Get the normal vector from the first line of each panel (after a blank line)
+                elif blank and len(line) > 1 and isint(line[0]) and isint(line[1]):
+                    if n_pan == len(pan_cp):
+                        raise ValueError("The Panair output has more panels than the networks of the aerodynamic mesh")
+                    pan_cp[n_pan, 1:] = [float(line[10]), float(line[11]), float(line[12])]
+                    panel = True
+
+            else:
+                summary_line += 1
+                if summary_line == 11:
+                    CL = float(line[3])
+                    CDi = float(line[4])
+                    break
+
+            blank = len(line) == 0
+
+        if CL is None:
+            raise ValueError("The lift and induced drag coefficients were not found in the Panair output")
+
+        return pan_cp[:n_pan], CL, CDi
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Block low-rank (BLR) approximation of an interpolation matrix.
+
+The rows and the columns of the matrix are attached to points (aerodynamic
+points and structural nodes for H). Both sets of points are clustered by
+recursive bisection, and each block of the matrix between a row cluster and a
+column cluster is replaced by its truncated SVD when that is smaller than the
+dense block. The truncation of each block is set so that the Frobenius norm of
+the error of the whole matrix is below tol times the norm of the matrix.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import numpy as np
+
+from scipy import linalg, sparse
+from scipy.sparse.linalg import LinearOperator, norm as sparse_norm
+
+from aerostructures.data_transfer.rbf_poly_bias import _TransposedOperator
+
+__all__ = ['BlockLowRankOperator']
+
+
+#Cluster the points x (n x d) by recursive bisection along the longest side of their bounding box.
+#Returns the permutation that makes the clusters contiguous and the bounds of the clusters
+def _cluster(x, leaf_size):
+    n = x.shape[0]
+    perm = np.arange(n)
+    leaves = []
+    stack = [(0, n)]
+    while stack:
+        i0, i1 = stack.pop()
+        if i1 - i0 <= leaf_size:
+            leaves.append((i0, i1))
+            continue
+
+        idx = perm[i0:i1]
+        pts = x[idx]
+        axis = (pts.max(axis=0) - pts.min(axis=0)).argmax()
+        perm[i0:i1] = idx[np.argsort(pts[:, axis], kind='mergesort')]
+
+        mid = (i0 + i1)//2
+        stack.append((mid, i1))
+        stack.append((i0, mid))
+
+    return perm, sorted(leaves)
+
+
+class BlockLowRankOperator(LinearOperator):
+    """
+    Block low-rank approximation of a dense (or scipy.sparse) matrix A whose
+    rows are attached to the points x_rows and whose columns are attached to
+    the points x_cols, with ||A - A_blr||_F <= tol ||A||_F.
+
+    dot/matvec and .T.dot/rmatvec work block by block on the compressed
+    factors. compression_ratio is the number of entries of A over the
+    number of stored entries.
+    """
+
+    def __init__(self, A, x_rows, x_cols, tol=1e-6, leaf_size=256):
+        if sparse.issparse(A):
+            A = sparse.csr_matrix(A)
+        n_rows, n_cols = A.shape
+
+        self.tol = tol
+        self.row_perm, row_leaves = _cluster(np.asarray(x_rows, dtype=float), leaf_size)
+        self.col_perm, col_leaves = _cluster(np.asarray(x_cols, dtype=float), leaf_size)
+
+        #Allowed squared error per entry, so that the total error is below tol ||A||_F
+        norm = sparse_norm(A) if sparse.issparse(A) else linalg.norm(A)
+        err2 = (tol*norm)**2/(n_rows*n_cols)
+
+        #Blocks (r0, r1, c0, c1, L, R) in the permuted ordering: A_block = L R, or L for the dense blocks (R is None)
+        self.blocks = []
+        self.n_stored = 0
+        for r0, r1 in row_leaves:
+            A_r = A[self.row_perm[r0:r1]]
+            if sparse.issparse(A_r):
+                A_r = A_r.toarray()
+            A_r = np.asarray(A_r, dtype=float)
+
+            for c0, c1 in col_leaves:
+                block = A_r[:, self.col_perm[c0:c1]]
+                m, n = block.shape
+
+                U, s, Vt = linalg.svd(block, full_matrices=False, check_finite=False)
+
+                #Smallest rank whose discarded singular values are within the error allowed to the block
+                tail = np.sqrt(np.cumsum(s[::-1]**2))[::-1]
+                rank = int(np.count_nonzero(tail > np.sqrt(err2*m*n)))
+
+                if rank*(m + n) < m*n:
+                    if rank > 0:
+                        self.blocks.append((r0, r1, c0, c1, U[:, :rank]*s[:rank], Vt[:rank].copy()))
+                    self.n_stored += rank*(m + n)
+                else:
+                    self.blocks.append((r0, r1, c0, c1, block.copy(), None))
+                    self.n_stored += m*n
+
+        self.compression_ratio = n_rows*n_cols/max(1, self.n_stored)
+
+        super(BlockLowRankOperator, self).__init__(dtype=np.float_, shape=(n_rows, n_cols))
+
+    def _matmat(self, U):
+        U = np.asarray(U)[self.col_perm]
+        Y = np.zeros((self.shape[0], U.shape[1]))
+        for r0, r1, c0, c1, L, R in self.blocks:
+            if R is None:
+                Y[r0:r1] += L.dot(U[c0:c1])
+            else:
+                Y[r0:r1] += L.dot(R.dot(U[c0:c1]))
+
+        out = np.empty_like(Y)
+        out[self.row_perm] = Y
+        return out
+
+    def _rmatmat(self, F):
+        F = np.asarray(F)[self.row_perm]
+        Y = np.zeros((self.shape[1], F.shape[1]))
+        for r0, r1, c0, c1, L, R in self.blocks:
+            if R is None:
+                Y[c0:c1] += L.T.dot(F[r0:r1])
+            else:
+                Y[c0:c1] += R.T.dot(L.T.dot(F[r0:r1]))
+
+        out = np.empty_like(Y)
+        out[self.col_perm] = Y
+        return out
+
+    def _matvec(self, u):
+        return self._matmat(np.asarray(u).reshape(-1, 1)).reshape(-1)
+
+    def _rmatvec(self, f):
+        return self._rmatmat(np.asarray(f).reshape(-1, 1)).reshape(-1)
+
+    def _adjoint(self):
+        return _TransposedOperator(self)
+
+    _transpose = _adjoint
+
+    #Relative error of the transfer of the fields U (columns) with respect to the reference matrix A
+    def transfer_error(self, A, U):
+        U = np.asarray(U, dtype=float).reshape(self.shape[1], -1)
+        Y = A.dot(U)
+        return linalg.norm(Y - self._matmat(U))/linalg.norm(Y)
@@ -6,6 +6,10 @@ from __future__ import print_function
 
 import numpy as np
 
+from scipy import sparse
+
+from aerostructures.data_transfer.transfer_products import batch_dot, batch_outer, StoragePrecision
+
 from openmdao.api import Component
 
 '''
@@ -15,7 +19,7 @@ the aerodynamic points
 class DisplacementTransfer(Component):
 
 
-    def __init__(self, na, ns):
+    def __init__(self, na, ns, pass_by_obj=False, n_cases=None, dtype=np.float64):
         super(DisplacementTransfer, self).__init__()
 
         #Number of points of the aerodynamic grid
@@ -24,14 +28,27 @@ class DisplacementTransfer(Component):
         #Number of nodes of the structural mesh on the outer skin
         self.ns = ns
 
+        #Storage precision of H: in single precision, H is converted once (and its accuracy checked)
+        #and the products accumulate in double precision
+        self.precision = StoragePrecision(dtype) if np.dtype(dtype) != np.float64 else None
+
         #Interpolation matrix H (xa = H xs)
-        self.add_param('H', val=np.zeros((self.na, self.ns)))
+        #It must be passed by object if it is not a dense array (e.g. the sparse H of Interpolation) or in single precision,
+        #and it can be to share a dense H by reference (Interpolation with pass_by_obj=True), without copies on the data transfers
+        if pass_by_obj or self.precision is not None:
+            self.add_param('H', val=sparse.csr_matrix((self.na, self.ns)), pass_by_obj=True)
+        else:
+            self.add_param('H', val=np.zeros((self.na, self.ns)))
+
+        #Number of load cases, stacked along the first dimension of the displacements (None: a single case)
+        self.n_cases = n_cases
+        shape = () if n_cases is None else (n_cases,)
 
         #Nodal displacements of the outer surface
-        self.add_param('u', val=np.zeros((self.ns, 3)))
+        self.add_param('u', val=np.zeros(shape + (self.ns, 3)))
 
         #Displacements of the aerodynamic grid points
-        self.add_output('delta', val=np.zeros((self.na, 3)))
+        self.add_output('delta', val=np.zeros(shape + (self.na, 3)))
 
 
     def solve_nonlinear(self, params, unknowns, resids):
@@ -39,6 +56,31 @@ class DisplacementTransfer(Component):
         u = params['u']
 
         H = params['H']
+        if self.precision is not None:
+            H = self.precision(H)
+
+        #Apply the interpolation matrix to obtain the aerodynamic points displacements (all the cases in a single product)
+        unknowns['delta'] = batch_dot(H, u)
 
-        #Apply the interpolation matrix to obtain the aerodynamic points displacements
-        unknowns['delta'] = H.dot(u)
+
+    #delta = H u is linear in u and in H, so the products with the Jacobian are computed
+    #without forming it: d(delta) = H du + dH u
+    def apply_linear(self, params, unknowns, dparams, dunknowns, dresids, mode):
+
+        u = params['u']
+
+        H = params['H']
+        if self.precision is not None:
+            H = self.precision(H)
+
+        if mode == 'fwd':
+            if 'u' in dparams:
+                dresids['delta'] += batch_dot(H, dparams['u'])
+            if 'H' in dparams:
+                dresids['delta'] += batch_dot(dparams['H'], u)
+
+        elif mode == 'rev':
+            if 'u' in dparams:
+                dparams['u'] += batch_dot(H.T, dresids['delta'])
+            if 'H' in dparams:
+                dparams['H'] += batch_outer(dresids['delta'], u)
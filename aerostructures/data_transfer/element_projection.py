@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Nearest element projection transfer.
+
+Each aerodynamic point is projected onto the closest face of the structural
+skin (CTRIA3 or CQUAD4 elements) and takes its displacement from the shape
+functions of that face at the projected point: barycentric coordinates for the
+triangles and bilinear functions (found by Gauss-Newton iterations) for the
+quadrilaterals. The candidate faces of each point are found with a KD-tree of
+the face centroids.
+
+The resulting H is a scipy.sparse matrix with at most 4 non-zeros per row,
+whose rows sum one (rigid translations are transferred exactly). Loads are
+transferred with its transpose, which conserves the total force.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import numpy as np
+
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+__all__ = ['ElementProjection']
+
+
+#Bilinear shape functions of a quadrilateral and their derivatives at the local coordinates (xi, eta)
+def _quad_shape(xi, eta):
+    N = 0.25*np.stack(((1 - xi)*(1 - eta), (1 + xi)*(1 - eta), (1 + xi)*(1 + eta), (1 - xi)*(1 + eta)), axis=-1)
+    dN_dxi = 0.25*np.stack((-(1 - eta), 1 - eta, 1 + eta, -(1 + eta)), axis=-1)
+    dN_deta = 0.25*np.stack((-(1 - xi), -(1 + xi), 1 + xi, 1 - xi), axis=-1)
+
+    return N, dN_dxi, dN_deta
+
+
+class ElementProjection(object):
+
+    def __init__(self, *args, **kwargs):
+        if len(args)%2 != 0:
+            raise ValueError("Output and input points must have the same dimension")
+        self.d = int(len(args)/2)
+        self.xs = np.asarray([np.asarray(a, dtype=float).flatten() for a in args[:self.d]])
+        self.xa = np.asarray([np.asarray(a, dtype=float).flatten() for a in args[self.d:]])
+        self.Ns = self.xs.shape[-1]
+        self.Na = self.xa.shape[-1]
+
+        #Connectivity of the skin faces (indices of the structural nodes, -1 as the fourth node of the triangles)
+        elements = kwargs.pop('elements', None)
+        if elements is None or len(elements) == 0:
+            raise ValueError("The element projection needs the connectivity of the skin elements")
+        self.elements = np.asarray(elements, dtype=int).reshape(len(elements), -1)
+        if self.elements.shape[1] == 3:
+            self.elements = np.hstack((self.elements, -np.ones((len(self.elements), 1), dtype=int)))
+
+        #Number of candidate faces of each aerodynamic point and number of Gauss-Newton iterations of the quadrilaterals
+        self.n_candidates = min(len(self.elements), kwargs.pop('n_candidates', 8))
+        self.n_iter = kwargs.pop('n_iter', 6)
+
+        self.H = self._build()
+
+
+    #Closest point of the face e to the point p: shape function values (n x 4) and distances (n)
+    def _project(self, e, p):
+        conn = self.elements[e]
+        X = np.transpose(self.xs)[np.maximum(conn, 0)]
+        quad = conn[:, 3] >= 0
+
+        N = np.zeros((len(e), 4))
+
+        #Triangles: barycentric coordinates of the projection onto the plane of the face, clamped to the face
+        tri = ~quad
+        if tri.any():
+            a, b, c = X[tri, 0], X[tri, 1], X[tri, 2]
+            v0, v1, v2 = b - a, c - a, p[tri] - a
+            d00 = (v0*v0).sum(axis=1)
+            d01 = (v0*v1).sum(axis=1)
+            d11 = (v1*v1).sum(axis=1)
+            d20 = (v2*v0).sum(axis=1)
+            d21 = (v2*v1).sum(axis=1)
+            den = d00*d11 - d01**2
+            v = (d11*d20 - d01*d21)/den
+            w = (d00*d21 - d01*d20)/den
+            L = np.maximum(np.column_stack((1 - v - w, v, w)), 0.)
+            N[tri, :3] = L/L.sum(axis=1)[:, np.newaxis]
+
+        #Quadrilaterals: bilinear local coordinates of the closest point (Gauss-Newton), clamped to the face
+        if quad.any():
+            Xq = X[quad]
+            pq = p[quad]
+            xi = np.zeros(len(Xq))
+            eta = np.zeros(len(Xq))
+            for it in range(self.n_iter):
+                Nq, dN_dxi, dN_deta = _quad_shape(xi, eta)
+                r = pq - np.einsum('ni,nij->nj', Nq, Xq)
+                t_xi = np.einsum('ni,nij->nj', dN_dxi, Xq)
+                t_eta = np.einsum('ni,nij->nj', dN_deta, Xq)
+                a11 = (t_xi*t_xi).sum(axis=1)
+                a12 = (t_xi*t_eta).sum(axis=1)
+                a22 = (t_eta*t_eta).sum(axis=1)
+                b1 = (t_xi*r).sum(axis=1)
+                b2 = (t_eta*r).sum(axis=1)
+                den = a11*a22 - a12**2
+                xi = np.clip(xi + (a22*b1 - a12*b2)/den, -1., 1.)
+                eta = np.clip(eta + (a11*b2 - a12*b1)/den, -1., 1.)
+            N[quad] = _quad_shape(xi, eta)[0]
+
+        dist = np.sqrt(((p - np.einsum('ni,nij->nj', N, X))**2).sum(axis=1))
+
+        return N, dist
+
+
+    def _build(self):
+        xs = np.transpose(self.xs)
+        xa = np.transpose(self.xa)
+        conn = self.elements
+
+        #Candidate faces: the closest face centroids of each aerodynamic point
+        n_nodes = np.where(conn[:, 3] >= 0, 4, 3)
+        centroids = np.where(conn[:, :, np.newaxis] >= 0, xs[np.maximum(conn, 0)], 0.).sum(axis=1)/n_nodes[:, np.newaxis]
+        candidates = cKDTree(centroids).query(xa, self.n_candidates)[1].reshape(self.Na, -1)
+
+        #Project every point onto its candidate faces and keep the closest projection
+        points = np.repeat(np.arange(self.Na), candidates.shape[1])
+        N, dist = self._project(candidates.ravel(), xa[points])
+        best = dist.reshape(self.Na, -1).argmin(axis=1)
+        pick = np.arange(self.Na)*candidates.shape[1] + best
+
+        N = N[pick]
+        nodes = conn[candidates.ravel()[pick]]
+        self.element = candidates.ravel()[pick]
+        self.distance = dist[pick]
+
+        #Sparse H with the shape function values of the closest face in each row
+        valid = nodes >= 0
+        rows = np.repeat(np.arange(self.Na), 4).reshape(self.Na, 4)
+
+        return sparse.csr_matrix((N[valid], (rows[valid], nodes[valid])), shape=(self.Na, self.Ns))
+
+
+    def __call__(self, *args):
+        args = [np.asarray(x) for x in args]
+        if not all([x.shape == y.shape for x in args for y in args]):
+            raise ValueError("Array lengths must be equal")
+        us = np.asarray([a.flatten() for a in args], dtype=float)
+
+        if self.xs.shape != us.shape:
+            raise ValueError("Points and values vectors must have the same shape")
+
+        return self.H.dot(us.transpose())
@@ -6,14 +6,24 @@ from __future__ import print_function
 
 import numpy as np
 
+import warnings
+
+from scipy import sparse
+
 from aerostructures.data_transfer.rbf_poly_bias import Rbf_poly_bias
+from aerostructures.data_transfer.rbf_partition_unity import Rbf_partition_unity
+from aerostructures.data_transfer.element_projection import ElementProjection
+from aerostructures.data_transfer.rbf_surfaces import Rbf_surfaces
+from aerostructures.data_transfer.interpolation_cache import InterpolationCache
+from aerostructures.data_transfer.block_low_rank import BlockLowRankOperator
+from aerostructures.data_transfer.transfer_products import StoragePrecision
+from aerostructures.data_transfer.out_of_core import load_out_of_core, save_key
 
 from openmdao.api import Component
 
 #Component which gives the interpolation matrix (H) given the aerodynamics and structural meshes
 class Interpolation(Component):
 
-
     def __init__(self, na, ns, **kwargs):
         super(Interpolation, self).__init__()
 
@@ -26,12 +36,118 @@ class Interpolation(Component):
         #RBF function type
         self.function_type = kwargs.pop('function', None)
 
-        #Epsilon parameter of the RBF functions
+        #Epsilon parameter of the RBF functions ('auto': minimum of the leave-one-out error, of each patch for the partition of unity)
         self.epsilon = kwargs.pop('epsilon', None)
 
         #Norm bias
         self.bias = kwargs.pop('bias', None)
 
+        #Method used to solve the RBF system (inverse, lu, cholesky, sparse or krylov)
+        self.solver = kwargs.pop('solver', 'inverse')
+
+        #Relative tolerance, maximum number of iterations and number of nodes of the preconditioner patches of the krylov solver
+        self.krylov_tol = kwargs.pop('krylov_tol', 1e-10)
+        self.krylov_maxiter = kwargs.pop('krylov_maxiter', 500)
+        self.krylov_patch = kwargs.pop('krylov_patch', 500)
+
+        #Memory budget (bytes) for the blocked distance and kernel evaluations
+        self.memory_budget = kwargs.pop('memory_budget', 2**27)
+
+        #Number of threads for the kernel evaluations of the global engine, also used as the limit of BLAS threads
+        self.n_threads = kwargs.pop('n_threads', None)
+
+        #Greedy data reduction: tolerance on the relative interpolation error (None: all the nodes are centres),
+        #nodal fields used to measure the error and maximum number of centres
+        self.reduction_tol = kwargs.pop('reduction_tol', None)
+        self.reduction_fields = kwargs.pop('reduction_fields', None)
+        self.max_centres = kwargs.pop('max_centres', None)
+
+        #Interpolation engine: a single RBF on all the structural nodes ('global'), local RBFs on overlapping
+        #patches blended with a partition of unity ('partition_unity') or the projection of the aerodynamic
+        #points onto the nearest skin element ('projection')
+        self.engine = kwargs.pop('engine', 'global')
+        if self.engine not in ('global', 'partition_unity', 'projection'):
+            raise ValueError("engine must be one of global, partition_unity, projection")
+
+        if self.engine != 'global' and self.reduction_tol is not None:
+            raise ValueError("The data reduction is only available with the global engine")
+
+        #Connectivity of the skin elements for the projection (e.g. StaticStructureProblemDimensions.skin_elements)
+        self.elements = kwargs.pop('elements', None)
+        if self.engine == 'projection' and (self.elements is None or len(self.elements) == 0):
+            raise ValueError("The projection engine needs the connectivity of the skin elements")
+
+        #Independent surface groups of the global engine (e.g. wing, tail and fin): list of (indices of the aerodynamic points,
+        #indices of the structural nodes), one RBF per group and a block-sparse H (None: a single RBF on all the nodes)
+        self.surfaces = kwargs.pop('surfaces', None)
+
+        if self.surfaces is not None and (self.engine != 'global' or self.solver in ('sparse', 'krylov')):
+            raise ValueError("The surface groups are only available with the global engine and a dense solver")
+
+        #Partition of unity and surface group options: number of nodes per patch, overlap ratio and number of processes
+        self.patch_nodes = kwargs.pop('patch_nodes', 100)
+        self.overlap = kwargs.pop('overlap', 2.)
+        self.n_procs = kwargs.pop('n_procs', 1)
+
+        #Block low-rank compression of H: tolerance on the relative error (None: H is not compressed)
+        #and number of points of the clusters that define the blocks
+        self.compression_tol = kwargs.pop('compression_tol', None)
+        self.leaf_size = kwargs.pop('leaf_size', 256)
+
+        if self.compression_tol is not None and self.solver in ('sparse', 'krylov') and self.engine == 'global':
+            raise ValueError("The compression of H is not available with the sparse and krylov solvers, whose H is already an operator")
+
+        #Pass H by object (shared by reference with the transfer components, no copies on the data transfers).
+        #H is then read-only and out of the linear system: the gradients do not include the shape derivatives
+        #(with respect to the coordinates) through H, so the default keeps it in the vectors
+        self.pass_by_obj = kwargs.pop('pass_by_obj', False)
+
+        #Storage precision of H (float64 or float32): a single precision H is passed by object,
+        #and the accuracy of its transfers is checked against the double precision H
+        dtype = np.dtype(kwargs.pop('dtype', np.float64))
+        self.precision = StoragePrecision(dtype) if dtype != np.float64 else None
+
+        if self.precision is not None and ((self.solver in ('sparse', 'krylov') and self.engine == 'global') or self.compression_tol is not None):
+            raise ValueError("H can only be stored in " + str(dtype) + " as an array or a sparse matrix")
+
+        #Out-of-core H: path of a .npy file where H is assembled by blocks of rows and from which the transfers stream it,
+        #mapping at most memory_budget bytes at a time. The file is reused by later runs with the same meshes and options
+        self.out_of_core = kwargs.pop('out_of_core', None)
+
+        if self.out_of_core is not None and (self.engine != 'global' or self.surfaces is not None or self.solver in ('sparse', 'krylov') or self.compression_tol is not None or self.precision is not None):
+            raise ValueError("The out-of-core H is only available with the global engine, a dense solver, no compression and double precision")
+
+        #Keep the structural operator (factorization of the RBF system) between runs, so that only the
+        #evaluation on the aerodynamic points is recomputed when the structural nodes do not change
+        self.reuse_structure = kwargs.pop('reuse_structure', True)
+        self.inter = None
+        self._node_coord = None
+        self._apoints_coord = None
+
+        #H and outputs of the last run, set again without rebuilding H when the meshes do not change
+        #(e.g. on the iterations of a coupled cycle), by reference so that no copy of H is kept
+        self._last = None
+
+        #Persistent cache of H, keyed by the meshes and the options (None: H is always built)
+        #cache_size is the maximum size of the cache directory (bytes), cache_storage the format of dense matrices (npy or npz)
+        cache_dir = kwargs.pop('cache_dir', None)
+        cache_size = kwargs.pop('cache_size', 2**30)
+        cache_storage = kwargs.pop('cache_storage', 'npy')
+        if cache_dir is not None:
+            self.cache = InterpolationCache(cache_dir, max_size=cache_size, storage=cache_storage)
+        else:
+            self.cache = None
+
+        #The sparse and krylov solvers, the partition of unity, the projection, the surface groups, the compression and the out-of-core storage
+        #give a sparse H or an operator, which is passed by object, as well as the single precision and pass_by_obj
+        self.h_by_obj = (self.pass_by_obj or self.solver in ('sparse', 'krylov') or self.engine != 'global' or self.surfaces is not None or self.compression_tol is not None
+                         or self.out_of_core is not None or self.precision is not None)
+
+        #The analytic derivatives of H are available for all the nodes as centres and a built-in function; H in the vectors is
+        #finite differenced otherwise. An H passed by object is not in the linear system, so it has no derivatives (see apply_linear)
+        if not self.h_by_obj and (self.reduction_tol is not None or callable(self.function_type)):
+            self.deriv_options['type'] = 'fd'
+
         #Aerodynamic grid points coordinates
         self.add_param('apoints_coord', val=np.zeros((self.na, 3)))
 
@@ -39,7 +155,34 @@ class Interpolation(Component):
         self.add_param('node_coord', val=np.zeros((self.ns, 3)))
 
         #Interpolation matrix H (xa = H xs)
-        self.add_output('H', val=np.zeros((self.na, self.ns)))
+        #(an H passed by object is not in the linear system, so these options do not give shape gradients)
+        if self.h_by_obj:
+            self.add_output('H', val=sparse.csr_matrix((self.na, self.ns)), pass_by_obj=True)
+            warnings.warn("H is passed by object: the gradients with respect to apoints_coord and node_coord do not include the derivatives of H")
+        else:
+            self.add_output('H', val=np.zeros((self.na, self.ns)))
+
+        if self.reduction_tol is not None:
+            #Number of RBF centres selected by the data reduction
+            self.add_output('n_centres', val=0)
+
+            #Relative interpolation error achieved on the nodes that are not centres
+            self.add_output('reduction_error', val=0.)
+
+        if self.compression_tol is not None:
+            #Number of entries of H over the number of entries stored by the compressed operator
+            self.add_output('compression_ratio', val=1.)
+
+            #Relative error of the transfer of the node coordinates by the compressed operator
+            self.add_output('compression_error', val=0.)
+
+        if self.epsilon == 'auto' and self.engine == 'global' and self.surfaces is None:
+            #Epsilon chosen by the leave-one-out cross-validation
+            self.add_output('epsilon', val=0.)
+
+        if self.precision is not None:
+            #Relative error of the transfers with the single precision H
+            self.add_output('precision_error', val=0.)
 
 
     def solve_nonlinear(self, params, unknowns, resids):
@@ -48,8 +191,173 @@ class Interpolation(Component):
 
         node_coord = self.params['node_coord']
 
+        #Same meshes as in the last run
+        if self._last is not None and np.array_equal(apoints_coord, self._last[0]) and np.array_equal(node_coord, self._last[1]):
+            for name, val in self._last[2].items():
+                unknowns[name] = val
+            return
+
+        self._last = None
+        outputs = {}
+        self._run(apoints_coord, node_coord, outputs)
+        for name, val in outputs.items():
+            unknowns[name] = val
+        self._last = (apoints_coord.copy(), node_coord.copy(), outputs)
+
+
+    #Build H and the other outputs for the given meshes
+    def _run(self, apoints_coord, node_coord, outputs):
+
+        #Reuse the out-of-core H if its file was assembled for the same meshes and options
+        if self.out_of_core is not None:
+            key = InterpolationCache.key((apoints_coord, node_coord), self._cache_options())
+            entry = load_out_of_core(self.out_of_core, key, memory_budget=self.memory_budget)
+            if entry is None:
+                inter = self._global_interpolation(apoints_coord, node_coord)
+                entry = inter.H, self._info(inter)
+                save_key(self.out_of_core, inter.H, key, entry[1])
+            H, info = entry
+            outputs['H'] = H
+            for name, val in info.items():
+                outputs[name] = val
+            return
+
+        #Look for H in the cache (user defined callable functions cannot be hashed reliably
+        #and the operators of the sparse and krylov solvers are not stored)
+        key = None
+        if self.cache is not None and not callable(self.function_type) and self.compression_tol is None and (self.solver not in ('sparse', 'krylov') or self.engine != 'global'):
+            key = self.cache.key((apoints_coord, node_coord), self._cache_options())
+            entry = self.cache.get(key)
+            if entry is not None:
+                H, info = entry
+                outputs['H'] = self._shared(H, outputs)
+                for name, val in info.items():
+                    outputs[name] = val
+                return
+
+        #Create a partition of unity of local RBF interpolations (solved by LU)
+        if self.engine == 'partition_unity':
+            inter = Rbf_partition_unity(node_coord[:, 0], node_coord[:, 1], node_coord[:, 2], apoints_coord[:, 0], apoints_coord[:, 1], apoints_coord[:, 2], function=self.function_type, epsilon=self.epsilon, bias=self.bias, memory_budget=self.memory_budget,
+                                        patch_nodes=self.patch_nodes, overlap=self.overlap, n_procs=self.n_procs)
+
+        #Project the aerodynamic points onto the nearest skin elements
+        elif self.engine == 'projection':
+            inter = ElementProjection(node_coord[:, 0], node_coord[:, 1], node_coord[:, 2], apoints_coord[:, 0], apoints_coord[:, 1], apoints_coord[:, 2], elements=self.elements)
+
+        #Build an independent RBF interpolation for each surface group
+        elif self.surfaces is not None:
+            inter = Rbf_surfaces(node_coord[:, 0], node_coord[:, 1], node_coord[:, 2], apoints_coord[:, 0], apoints_coord[:, 1], apoints_coord[:, 2], surfaces=self.surfaces, n_procs=self.n_procs,
+                                 function=self.function_type, epsilon=self.epsilon, bias=self.bias, solver=self.solver, memory_budget=self.memory_budget, n_threads=self.n_threads,
+                                 reduction_tol=self.reduction_tol, reduction_fields=self.reduction_fields, max_centres=self.max_centres)
+
+        else:
+            inter = self._global_interpolation(apoints_coord, node_coord)
+
+        #Set the interpolation matrix (H) as an output, compressed if required
+        if self.compression_tol is not None:
+            H = BlockLowRankOperator(inter.H, apoints_coord, node_coord, tol=self.compression_tol, leaf_size=self.leaf_size)
+            outputs['H'] = H
+            outputs['compression_ratio'] = H.compression_ratio
+            outputs['compression_error'] = H.transfer_error(inter.H, node_coord)
+        else:
+            outputs['H'] = self._shared(inter.H, outputs)
+
+        #Set the data reduction results and the automatic epsilon as outputs
+        info = self._info(inter)
+        for name, val in info.items():
+            outputs[name] = val
+
+        #Store H in the cache
+        if key is not None:
+            self.cache.put(key, inter.H, info)
+
+
+    #Data reduction results and automatic epsilon of an interpolation
+    def _info(self, inter):
+        info = {}
+        if self.epsilon == 'auto' and self.engine == 'global' and self.surfaces is None:
+            info['epsilon'] = float(inter.epsilon)
+        if self.reduction_tol is not None:
+            info.update(n_centres=int(inter.n_centres), reduction_error=float(inter.reduction_error))
+
+        return info
+
+
+    #H in the storage precision. H passed by object is shared by all the components that use it, so dense arrays are made read-only
+    def _shared(self, H, outputs):
+        if self.precision is not None:
+            H = self.precision(H)
+            outputs['precision_error'] = self.precision.error
+
+        if (self.pass_by_obj or self.precision is not None) and isinstance(H, np.ndarray):
+            H.flags.writeable = False
+
+        return H
+
+
+    #RBF interpolation on all the structural nodes, reusing the previous one when possible
+    def _global_interpolation(self, apoints_coord, node_coord):
+
+        inter = self.inter
+        same_nodes = inter is not None and np.array_equal(node_coord, self._node_coord)
+
+        #Same meshes as in the previous run (e.g. when computing derivatives)
+        if same_nodes and np.array_equal(apoints_coord, self._apoints_coord):
+            return inter
+
+        #Same structural nodes: only the aerodynamic side is recomputed, O(na ns) instead of O(ns^3)
+        if same_nodes and self.reuse_structure:
+            inter.update_target(apoints_coord[:, 0], apoints_coord[:, 1], apoints_coord[:, 2])
+
         #Create an RBF interpolation with polynomial terms from the structural nodes and aerodynamic points coordinates
-        inter = Rbf_poly_bias(node_coord[:, 0], node_coord[:, 1], node_coord[:, 2], apoints_coord[:, 0], apoints_coord[:, 1], apoints_coord[:, 2], function=self.function_type, epsilon=self.epsilon, bias=self.bias)
+        else:
+            inter = Rbf_poly_bias(node_coord[:, 0], node_coord[:, 1], node_coord[:, 2], apoints_coord[:, 0], apoints_coord[:, 1], apoints_coord[:, 2], function=self.function_type, epsilon=self.epsilon, bias=self.bias, solver=self.solver, memory_budget=self.memory_budget, n_threads=self.n_threads,
+                                  reduction_tol=self.reduction_tol, reduction_fields=self.reduction_fields, max_centres=self.max_centres, out_of_core=self.out_of_core,
+                                  krylov_tol=self.krylov_tol, krylov_maxiter=self.krylov_maxiter, krylov_patch=self.krylov_patch)
+
+        self.inter = inter
+        self._node_coord = node_coord.copy()
+        self._apoints_coord = apoints_coord.copy()
+
+        return inter
+
+
+    #Jacobian-vector and vector-Jacobian products of H with respect to the coordinates,
+    #using the factorization of the RBF system (no finite differences through the build)
+    def apply_linear(self, params, unknowns, dparams, dunknowns, dresids, mode):
+
+        #H passed by object has no derivatives (and no finite differences, which would rebuild it for nothing)
+        if self.h_by_obj:
+            return
+
+        inter = self._global_interpolation(params['apoints_coord'], params['node_coord'])
+
+        if mode == 'fwd':
+            dxs = dparams['node_coord'].T if 'node_coord' in dparams else None
+            dxa = dparams['apoints_coord'].T if 'apoints_coord' in dparams else None
+            dresids['H'] += inter.jvp(dxs, dxa)
+
+        elif mode == 'rev':
+            dxs, dxa = inter.vjp(dresids['H'])
+            if 'node_coord' in dparams:
+                dparams['node_coord'] += dxs.T
+            if 'apoints_coord' in dparams:
+                dparams['apoints_coord'] += dxa.T
+
+
+    #Options that change H, used to build the cache key
+    def _cache_options(self):
+        options = {'function': self.function_type, 'epsilon': self.epsilon, 'bias': self.bias, 'engine': self.engine}
+
+        if self.engine == 'projection':
+            options = {'engine': self.engine, 'elements': InterpolationCache.key((self.elements,), {})}
+        elif self.engine == 'partition_unity':
+            options.update(patch_nodes=self.patch_nodes, overlap=self.overlap)
+        else:
+            options.update(reduction_tol=self.reduction_tol, max_centres=self.max_centres,
+                           reduction_fields=None if self.reduction_fields is None else InterpolationCache.key((self.reduction_fields,), {}))
+            if self.surfaces is not None:
+                options['surfaces'] = InterpolationCache.key([idx for group in self.surfaces for idx in group], {})
+
+        return options
 
-        #Set the interpolation matrix (H) as an output
-        unknowns['H'] = inter.H
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of interpolation matrices.
+
+The entries are addressed by a hash of the mesh coordinates and of the
+interpolation options, so a matrix built in a previous run (or a previous DOE
+point) with byte-identical meshes is loaded instead of rebuilt. Dense matrices
+are stored as .npy files and loaded memory-mapped (read-only), or as
+compressed .npz files; sparse matrices are always stored as .npz files. The
+least recently used entries are removed when the cache exceeds its size.
+"""
+
+from __future__ import print_function
+
+import os
+
+import json
+
+import hashlib
+
+import tempfile
+
+import numpy as np
+
+from scipy import sparse
+
+__all__ = ['InterpolationCache']
+
+#Version of the cache entries, to be increased when the interpolation algorithms change the result
+CACHE_VERSION = 1
+
+#Atomic file replacement (os.replace is not available in Python 2)
+_replace = getattr(os, 'replace', os.rename)
+
+
+class InterpolationCache(object):
+
+    def __init__(self, directory, max_size=2**30, storage='npy'):
+
+        #Directory of the cache files
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        #Maximum size of the cache (bytes)
+        self.max_size = max_size
+
+        #Storage of the dense matrices: memory-mapped .npy or compressed .npz
+        if storage not in ('npy', 'npz'):
+            raise ValueError("storage must be one of npy, npz")
+        self.storage = storage
+
+        #Number of matrices loaded from and missing in the cache
+        self.hits = 0
+        self.misses = 0
+
+
+    #Hash of the coordinate arrays and of the options (a dictionary of values with a stable repr)
+    @staticmethod
+    def key(arrays, options):
+        h = hashlib.sha1()
+        h.update(str(CACHE_VERSION).encode())
+        for a in arrays:
+            a = np.ascontiguousarray(a, dtype=float)
+            h.update(str(a.shape).encode())
+            h.update(a.tobytes())
+        h.update(repr(sorted(options.items())).encode())
+
+        return h.hexdigest()
+
+
+    def _path(self, key, ext):
+        return os.path.join(self.directory, key + ext)
+
+
+    #Return the matrix and the information stored with it, or None if the key is not in the cache
+    def get(self, key):
+        meta_path = self._path(key, '.json')
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta['format'] == 'sparse':
+                H = sparse.load_npz(self._path(key, '.npz'))
+            elif meta['format'] == 'npy':
+                H = np.load(self._path(key, '.npy'), mmap_mode='r')
+            else:
+                with np.load(self._path(key, '.npz')) as data:
+                    H = data['H']
+        except (IOError, OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+
+        #Mark the entry as recently used
+        os.utime(meta_path, None)
+
+        self.hits += 1
+
+        return H, meta['info']
+
+
+    #Store a matrix and a dictionary of information (JSON serializable) with it
+    def put(self, key, H, info=None):
+        if sparse.issparse(H):
+            fmt, ext = 'sparse', '.npz'
+        else:
+            fmt = self.storage
+            ext = '.' + fmt
+
+        #Write to temporary files and rename them, so that concurrent runs never read partial entries
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            if fmt == 'sparse':
+                sparse.save_npz(f, sparse.csr_matrix(H))
+            elif fmt == 'npy':
+                np.save(f, np.asarray(H))
+            else:
+                np.savez_compressed(f, H=np.asarray(H))
+        _replace(tmp, self._path(key, ext))
+
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'format': fmt, 'shape': list(H.shape), 'info': info or {}}, f)
+        _replace(tmp, self._path(key, '.json'))
+
+        self.evict()
+
+
+    #Remove the least recently used entries until the cache fits in its maximum size
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-5]
+            files = [self._path(key, ext) for ext in ('.json', '.npy', '.npz')]
+            files = [p for p in files if os.path.exists(p)]
+            size = sum([os.path.getsize(p) for p in files])
+            entries.append((os.path.getmtime(self._path(key, '.json')), size, files))
+            total += size
+
+        entries.sort(key=lambda e: e[0])
+
+        #The most recent entry is always kept
+        for mtime, size, files in entries[:-1]:
+            if total <= self.max_size:
+                break
+            for p in files:
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+            total -= size
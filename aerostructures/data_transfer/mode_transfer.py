@@ -6,6 +6,10 @@ from __future__ import print_function
 
 import numpy as np
 
+from scipy import sparse
+
+from aerostructures.data_transfer.transfer_products import batch_dot, StoragePrecision
+
 from openmdao.api import Component
 
 '''
@@ -15,7 +19,7 @@ Component which takes the matrix of normal modes on a grid and gives the matrix
 
 class ModeTransfer(Component):
 
-    def __init__(self, nr, nm, N, BC):
+    def __init__(self, nr, nm, N, BC, pass_by_obj=False, dtype=np.float64):
         super(ModeTransfer, self).__init__()
 
         # Number of points of the source grid
@@ -30,8 +34,30 @@ class ModeTransfer(Component):
         # Table indicating whether a DOF in the target model is either free (1) or constrained (0)
         self.BC = BC
 
+        # Mask of the boundary conditions for the 6N columns of the target modes, computed once
+        self.mask = np.array(np.broadcast_to(np.tile(np.asarray(BC, dtype=float), N), (nm, 6*N)))
+
+        # Target points with at least one free DOF (the rows of the fully constrained points are zero)
+        self.free = np.flatnonzero(self.mask.any(axis=1))
+        self.mask_free = self.mask[self.free]
+        self.all_free = len(self.free) == nm
+
+        # Storage precision of H: in single precision, H is converted once (and its accuracy checked)
+        # and the products accumulate in double precision
+        self.precision = StoragePrecision(dtype) if np.dtype(dtype) != np.float64 else None
+
         # Interpolation matrix H (xm = H xr)
-        self.add_param('H', val=np.zeros((self.nm, self.nr)))
+        # It must be passed by object if it is not a dense array (e.g. the sparse H of Interpolation) or in single precision,
+        # and it can be to share a dense H by reference (Interpolation with pass_by_obj=True), without copies on the data transfers
+        self.pass_by_obj = pass_by_obj or self.precision is not None
+        if self.pass_by_obj:
+            self.add_param('H', val=sparse.csr_matrix((self.nm, self.nr)), pass_by_obj=True)
+        else:
+            self.add_param('H', val=np.zeros((self.nm, self.nr)))
+
+        # H passed by object of the last run and its rows of the target points with free DOFs
+        self._H_source = None
+        self._H_free = None
 
         # Matrix of source normal modes
         self.add_param('Phi_r', val=np.zeros((self.nr, 6*N)))
@@ -44,15 +70,60 @@ class ModeTransfer(Component):
         Phi_r = params['Phi_r']
 
         H = params['H']
+        if self.precision is not None:
+            H = self.precision(H)
 
-        N = self.N
+        H_free, rows, mask = self._free_rows(H)
 
-        BC = self.BC
+        # Apply the interpolation matrix to obtain displacements on target grid (points with free DOFs only)
+        Phi_free = batch_dot(H_free, Phi_r)
 
-        # Apply the interpolation matrix to obtain displacements on target grid
-        Phi_m = H.dot(Phi_r)
+        # Apply the known boundary conditions to the target model displacements, in place
+        Phi_free *= mask
 
-        # Apply the known boundary conditions to the target model displacements
-        Phi_m = np.multiply(Phi_m, np.tile(BC, N))
+        Phi_m = np.zeros((self.nm, 6*self.N))
+        Phi_m[rows] = Phi_free
 
         unknowns['Phi_m'] = Phi_m
+
+    # Rows of H of the target points with free DOFs, their indices and their mask
+    # H in the vectors is updated in place, so its rows are extracted on every call, and the rows of an H passed by object
+    # once per H object (a new H is a new object). Operators have no row access, so they are applied to all the points
+    # (the mask zeroes the other rows)
+    def _free_rows(self, H):
+        if self.all_free or not hasattr(H, '__getitem__'):
+            return H, slice(None), self.mask
+
+        if not self.pass_by_obj:
+            return H[self.free], self.free, self.mask_free
+
+        if H is not self._H_source:
+            self._H_free = H[self.free]
+            self._H_source = H
+
+        return self._H_free, self.free, self.mask_free
+
+    # Phi_m = (H Phi_r) * BC is linear in Phi_r and in H, so the products with the Jacobian are computed
+    # without forming it: d(Phi_m) = (H dPhi_r + dH Phi_r) * BC
+    def apply_linear(self, params, unknowns, dparams, dunknowns, dresids, mode):
+
+        Phi_r = params['Phi_r']
+
+        H = params['H']
+        if self.precision is not None:
+            H = self.precision(H)
+
+        H_free, rows, mask = self._free_rows(H)
+
+        if mode == 'fwd':
+            if 'Phi_r' in dparams:
+                dresids['Phi_m'][rows] += np.multiply(batch_dot(H_free, dparams['Phi_r']), mask)
+            if 'H' in dparams:
+                dresids['Phi_m'][rows] += np.multiply(dparams['H'][rows].dot(Phi_r), mask)
+
+        elif mode == 'rev':
+            dPhi_m = np.multiply(dresids['Phi_m'][rows], mask)
+            if 'Phi_r' in dparams:
+                dparams['Phi_r'] += batch_dot(H_free.T, dPhi_m)
+            if 'H' in dparams:
+                dparams['H'][rows] += dPhi_m.dot(Phi_r.T)
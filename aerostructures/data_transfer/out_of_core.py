@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Out-of-core storage of large interpolation matrices.
+
+The matrix is written block of rows by block of rows to a .npy file (so that
+it is never fully in memory) and used through OutOfCoreMatrix, a
+LinearOperator that maps one block of rows of the file at a time for the
+products H u and H^T f. The mapped blocks are released after each product, so
+the resident memory is bounded by memory_budget whatever the size of H.
+
+A JSON sidecar stores the key of the meshes and options of the matrix, so a
+later run with the same key uses the file instead of assembling it again.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import os
+
+import json
+
+import tempfile
+
+import numpy as np
+
+from scipy.sparse.linalg import LinearOperator
+
+from aerostructures.data_transfer.rbf_poly_bias import _TransposedOperator
+
+__all__ = ['OutOfCoreMatrix', 'write_row_blocks', 'save_key', 'load_out_of_core']
+
+#Atomic file replacement (os.replace is not available in Python 2)
+_replace = getattr(os, 'replace', os.rename)
+
+
+#Write the row blocks (iterable of arrays, in order) of a matrix of the given shape to the .npy file path.
+#Returns the matrix as an OutOfCoreMatrix
+def write_row_blocks(path, shape, blocks, dtype=np.float64, memory_budget=2**27):
+    dtype = np.dtype(dtype)
+    directory = os.path.dirname(os.path.abspath(path))
+
+    #The sidecar of the previous matrix is removed first, so that it never describes a partial file
+    if os.path.exists(path + '.json'):
+        os.remove(path + '.json')
+
+    #Write to a temporary file and rename it, so that concurrent runs never read a partial matrix
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    n_written = 0
+    with os.fdopen(fd, 'wb') as f:
+        np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': tuple(shape)})
+        for block in blocks:
+            block = np.ascontiguousarray(block, dtype=dtype)
+            if block.ndim != 2 or block.shape[1] != shape[1]:
+                raise ValueError("The row blocks must have " + str(shape[1]) + " columns")
+            f.write(block.tobytes())
+            n_written += block.shape[0]
+
+    if n_written != shape[0]:
+        os.remove(tmp)
+        raise ValueError("The row blocks have " + str(n_written) + " rows instead of " + str(shape[0]))
+
+    _replace(tmp, path)
+
+    return OutOfCoreMatrix(path, memory_budget=memory_budget)
+
+
+#Write the key (e.g. a hash of the meshes and options) of the matrix H stored in path and
+#a dictionary of information (JSON serializable) to its sidecar
+def save_key(path, H, key, info=None):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'key': key, 'shape': list(H.shape), 'info': info or {}}, f)
+    _replace(tmp, path + '.json')
+
+
+#Matrix stored in path and the information stored with it if its sidecar has the given key, None otherwise
+def load_out_of_core(path, key, memory_budget=2**27):
+    try:
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        if meta['key'] != key:
+            return None
+        H = OutOfCoreMatrix(path, memory_budget=memory_budget)
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+    if list(H.shape) != meta['shape']:
+        return None
+
+    return H, meta['info']
+
+
+class OutOfCoreMatrix(LinearOperator):
+    """
+    Matrix stored in a .npy file, used block of rows by block of rows.
+
+    dot/matvec and .T.dot/rmatvec map at most memory_budget bytes of the file
+    at a time. Single precision files are upcast by blocks, so the products
+    accumulate in double precision.
+    """
+
+    def __init__(self, path, memory_budget=2**27):
+        self.path = path
+        self.memory_budget = memory_budget
+
+        #Shape, type and position of the data in the file
+        with open(path, 'rb') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            self.offset = f.tell()
+
+        if len(shape) != 2 or fortran_order:
+            raise ValueError(path + " does not contain a C ordered matrix")
+        self.storage_dtype = np.dtype(dtype)
+
+        #Number of rows of the mapped blocks (upcast to double precision if needed)
+        self.n_rows = max(1, int(memory_budget//(8*max(1, shape[1]))))
+
+        super(OutOfCoreMatrix, self).__init__(dtype=np.float64, shape=tuple(shape))
+
+    #Rows i0 to i1 of the matrix, mapped from the file
+    def _block(self, i0, i1):
+        n = self.shape[1]
+        return np.memmap(self.path, dtype=self.storage_dtype, mode='r', offset=self.offset + i0*n*self.storage_dtype.itemsize, shape=(i1 - i0, n))
+
+    def _row_blocks(self):
+        for i0 in range(0, self.shape[0], self.n_rows):
+            i1 = min(self.shape[0], i0 + self.n_rows)
+            block = self._block(i0, i1)
+            yield i0, i1, np.asarray(block, dtype=np.float64)
+            #Unmap the block, releasing its pages
+            del block
+
+    def _matmat(self, U):
+        U = np.asarray(U)
+        Y = np.empty((self.shape[0], U.shape[1]))
+        for i0, i1, block in self._row_blocks():
+            Y[i0:i1] = block.dot(U)
+
+        return Y
+
+    def _rmatmat(self, F):
+        F = np.asarray(F)
+        Y = np.zeros((self.shape[1], F.shape[1]))
+        for i0, i1, block in self._row_blocks():
+            Y += block.T.dot(F[i0:i1])
+
+        return Y
+
+    def _matvec(self, u):
+        return self._matmat(np.asarray(u).reshape(-1, 1)).reshape(-1)
+
+    def _rmatvec(self, f):
+        return self._rmatmat(np.asarray(f).reshape(-1, 1)).reshape(-1)
+
+    def _adjoint(self):
+        return _TransposedOperator(self)
+
+    _transpose = _adjoint
+
+    #Dense copy of the matrix (it must fit in memory)
+    def toarray(self):
+        return np.load(self.path).astype(np.float64)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Partition of unity RBF interpolation.
+
+The structural nodes are covered with overlapping patches (found with a
+KD-tree), a small RBF interpolation with polynomial terms (Rbf_poly_bias) is
+built on each patch and the local interpolations are blended with Wendland
+weight functions normalized to sum one (Shepard). Since every local
+interpolation reproduces linear fields, the blended one does too.
+
+The resulting H is a scipy.sparse matrix with, for each aerodynamic point,
+only the weights of the nodes of the patches that cover it. The patch
+problems are independent and can be solved in a process pool (n_procs > 1);
+on Windows, the calling script must then be protected by
+if __name__ == '__main__'.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import multiprocessing
+
+import numpy as np
+
+from scipy import linalg, sparse
+from scipy.spatial import cKDTree
+
+from aerostructures.data_transfer.rbf_poly_bias import Rbf_poly_bias
+
+__all__ = ['Rbf_partition_unity']
+
+
+#Local interpolation matrix of a patch (module level function, so that it can be sent to a process pool)
+def _patch_interpolation(args):
+    xs, xa, flat_tol, kwargs = args
+
+    #Local frame of the patch, dropping the directions along which the patch is flat
+    #(a linear polynomial cannot be identified along them)
+    centre = xs.mean(axis=1)[:, np.newaxis]
+    U, sv = linalg.svd(xs - centre, full_matrices=False)[:2]
+    U = U[:, sv > flat_tol*sv[0]]
+
+    ys = U.T.dot(xs - centre)
+    ya = U.T.dot(xa - centre)
+
+    #The coordinates are already scaled by the norm bias
+    return Rbf_poly_bias(*(tuple(ys) + tuple(ya)), bias=(1.,)*len(ys), **kwargs).H
+
+
+class Rbf_partition_unity(object):
+
+    def __init__(self, *args, **kwargs):
+        if len(args)%2 != 0:
+            raise ValueError("Output and input points must have the same dimension")
+        self.d = int(len(args)/2)
+        self.xs = np.asarray([np.asarray(a, dtype=float).flatten() for a in args[:self.d]])
+        self.xa = np.asarray([np.asarray(a, dtype=float).flatten() for a in args[self.d:]])
+        self.Ns = self.xs.shape[-1]
+        self.Na = self.xa.shape[-1]
+
+        #Norm bias
+        self.k = kwargs.pop('bias', None)
+        if self.k is None:
+            self.k = (1,)*self.d
+        if len(self.k) != self.d:
+            raise ValueError("The tuple containing the norm bias coefficients and the dimension of the problem must be the same size")
+
+        #Number of structural nodes of each patch
+        self.patch_nodes = min(self.Ns, kwargs.pop('patch_nodes', 100))
+
+        #Ratio between the radius of a patch and the radius of the region it covers (> 1 for overlapping patches)
+        self.overlap = kwargs.pop('overlap', 2.)
+
+        #Relative singular value below which a patch is considered flat along a direction
+        self.flat_tol = kwargs.pop('flat_tol', 1e-2)
+
+        #Number of processes used for the patch problems
+        self.n_procs = kwargs.pop('n_procs', 1)
+
+        #Options of the local interpolations (function, epsilon, solver...)
+        kwargs.setdefault('solver', 'lu')
+        self.local_options = kwargs
+
+        #Scale the coordinates so that the biased norm becomes the euclidean norm
+        sk = np.sqrt(np.asarray(self.k, dtype=float))[:, np.newaxis]
+        ys = sk*self.xs
+        ya = sk*self.xa
+
+        self._cover(ys)
+
+        self.H = self._blend(ys, ya)
+
+
+    #Cover the structural nodes with patches: the nearest patch_nodes nodes of a centre form a patch,
+    #and the nodes closer to the centre than radius/overlap are covered by it
+    def _cover(self, ys):
+        tree_s = cKDTree(ys.T)
+
+        covered = np.zeros(self.Ns, dtype=bool)
+        centres = []
+        radii = []
+        patches = []
+
+        for i in range(self.Ns):
+            if covered[i]:
+                continue
+
+            dist, nodes = tree_s.query(ys[:, i], self.patch_nodes)
+            dist = np.atleast_1d(dist)
+            nodes = np.atleast_1d(nodes)
+            radius = dist[-1]
+
+            covered[tree_s.query_ball_point(ys[:, i], radius/self.overlap)] = True
+            covered[i] = True
+
+            centres.append(i)
+            radii.append(radius)
+            patches.append(nodes)
+
+        #Centre node, radius and nodes of each patch
+        self.centres = np.asarray(centres)
+        self.radii = np.asarray(radii)
+        self.patches = patches
+        self.n_patches = len(centres)
+
+
+    #Solve the local problems and blend them with normalized Wendland C2 weights
+    def _blend(self, ys, ya):
+        radii = self.radii
+
+        #Aerodynamic points within the radius of each patch and their weights
+        tree_c = cKDTree(ys[:, self.centres].T)
+        tree_a = cKDTree(ya.T)
+        pairs = tree_c.sparse_distance_matrix(tree_a, radii.max(), output_type='ndarray')
+        q = pairs['v']/radii[pairs['i']]
+        inside = q < 1.
+        patch = pairs['i'][inside]
+        point = pairs['j'][inside]
+        q = q[inside]
+        w = (1. - q)**4*(4.*q + 1.)
+
+        #Aerodynamic points outside every patch take the interpolation of the nearest patch
+        orphans = np.setdiff1d(np.arange(self.Na), point)
+        if len(orphans) > 0:
+            patch = np.hstack((patch, tree_c.query(ya[:, orphans].T)[1]))
+            point = np.hstack((point, orphans))
+            w = np.hstack((w, np.ones(len(orphans))))
+
+        #Shepard normalization, so that the weights of each aerodynamic point sum one
+        w = w/np.bincount(point, weights=w, minlength=self.Na)[point]
+
+        #Sort the aerodynamic points by patch
+        order = np.argsort(patch, kind='mergesort')
+        patch = patch[order]
+        point = point[order]
+        w = w[order]
+        bounds = np.searchsorted(patch, np.arange(self.n_patches + 1))
+
+        active = [j for j in range(self.n_patches) if bounds[j+1] > bounds[j]]
+        tasks = [(ys[:, self.patches[j]], ya[:, point[bounds[j]:bounds[j+1]]], self.flat_tol, self.local_options) for j in active]
+
+        if self.n_procs > 1:
+            pool = multiprocessing.Pool(self.n_procs)
+            try:
+                H_local = pool.map(_patch_interpolation, tasks, chunksize=max(1, len(tasks)//(4*self.n_procs)))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            H_local = [_patch_interpolation(task) for task in tasks]
+
+        #Assemble the weighted local interpolation matrices
+        rows = []
+        cols = []
+        vals = []
+        for j, H_j in zip(active, H_local):
+            w_j = w[bounds[j]:bounds[j+1]]
+            rows.append(np.repeat(point[bounds[j]:bounds[j+1]], H_j.shape[1]))
+            cols.append(np.tile(self.patches[j], H_j.shape[0]))
+            vals.append((w_j[:, np.newaxis]*H_j).ravel())
+
+        return sparse.csr_matrix((np.hstack(vals), (np.hstack(rows), np.hstack(cols))), shape=(self.Na, self.Ns))
+
+
+    def __call__(self, *args):
+        args = [np.asarray(x) for x in args]
+        if not all([x.shape == y.shape for x in args for y in args]):
+            raise ValueError("Array lengths must be equal")
+        us = np.asarray([a.flatten() for a in args], dtype=float)
+
+        if self.xs.shape != us.shape:
+            raise ValueError("Points and values vectors must have the same shape")
+
+        return self.H.dot(us.transpose())
@@ -57,27 +57,55 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 from __future__ import division, print_function, absolute_import
 
 import sys
+import copy
+import warnings
+
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
 from numpy import (sqrt, log, asarray, newaxis, all, dot, exp, eye,
-                   float_, vstack, hstack, ones, transpose, zeros)
-from scipy import linalg
+                   float_, vstack, hstack, ones, transpose, zeros, empty,
+                   einsum, maximum, absolute, inf, diag, argsort, isfinite)
+from numpy.random import RandomState
+from scipy import linalg, sparse, optimize
+from scipy.sparse.linalg import splu, gmres, LinearOperator, aslinearoperator
+from scipy.spatial import cKDTree
 from scipy._lib.six import callable, get_method_function, \
      get_function_code
 
-__all__ = ['Rbf_poly_bias']
+#threadpoolctl is used to limit the number of BLAS threads (installed with the package on Python 3)
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+__all__ = ['Rbf_poly_bias', 'SparseRbfOperator', 'KrylovRbfOperator']
+
+
+#Limit the number of BLAS threads (not limited, with a warning, if threadpoolctl is not available)
+@contextmanager
+def _blas_threads(n_threads):
+    if n_threads is None:
+        yield
+    elif threadpool_limits is None:
+        warnings.warn("threadpoolctl is not installed: the number of BLAS threads is not limited to n_threads=" + str(n_threads) + ", so the kernel threads and the BLAS threads may oversubscribe the cores")
+        yield
+    else:
+        with threadpool_limits(limits=n_threads, user_api='blas'):
+            yield
 
 
 class Rbf_poly_bias(object):
 
     #Modify the euclidean norm according to the norm bias
     def _norm(self, x1, x2):
-        diff_sq = (x1 - x2)**2
-        k = self.k
-        if len(diff_sq) != len(k):
+        diff = x1 - x2
+        k = asarray(self.k, dtype=float_)
+        if len(diff) != len(k):
             raise ValueError("The tuple containing the norm bias coefficients and the dimension of the problem must be the same size")
 
-        diff_sq = asarray([k[i]*diff_sq[i] for i in range(len(k))])
-        return sqrt((diff_sq).sum(axis=0))
+        #Apply the bias weights and sum over the dimensions in a single pass
+        return sqrt(einsum('i,i...,i...->...', k, diff, diff))
 
     def _h_multiquadric(self, r):
         return sqrt((1.0/self.epsilon*r)**2 + 1)
@@ -102,6 +130,62 @@ class Rbf_poly_bias(object):
         result[r == 0] = 0  # the spline is zero at zero
         return result
 
+    #Wendland compactly supported functions, epsilon is the support radius
+    def _h_wendland_c0(self, r):
+        q = maximum(1.0 - 1.0/self.epsilon*r, 0.)
+        return q**2
+
+    def _h_wendland_c2(self, r):
+        q = maximum(1.0 - 1.0/self.epsilon*r, 0.)
+        return q**4*(4.0/self.epsilon*r + 1)
+
+    def _h_wendland_c4(self, r):
+        q = maximum(1.0 - 1.0/self.epsilon*r, 0.)
+        return q**6*(35.0*(1.0/self.epsilon*r)**2 + 18.0/self.epsilon*r + 3)/3.0
+
+    #Derivatives of the functions, phi'(r)/r (the derivative with respect to epsilon is -r^2/epsilon phi'(r)/r
+    #for the functions of r/epsilon). The value at r = 0 does not matter, since it multiplies a zero distance
+    _scaled_functions = ('multiquadric', 'inverse_multiquadric', 'gaussian', 'wendland_c0', 'wendland_c2', 'wendland_c4')
+
+    def _d_multiquadric(self, r):
+        return 1.0/(self.epsilon**2*self._h_multiquadric(r))
+
+    def _d_inverse_multiquadric(self, r):
+        return -self._h_inverse_multiquadric(r)**3/self.epsilon**2
+
+    def _d_gaussian(self, r):
+        return -2.0*self._h_gaussian(r)/self.epsilon**2
+
+    def _d_linear(self, r):
+        result = 1.0/maximum(r, 1e-300)
+        result[r == 0] = 0
+        return result
+
+    def _d_cubic(self, r):
+        return 3.0*r
+
+    def _d_quintic(self, r):
+        return 5.0*r**3
+
+    def _d_thin_plate(self, r):
+        result = 2.0*log(maximum(r, 1e-300)) + 1.0
+        result[r == 0] = 0
+        return result
+
+    def _d_wendland_c0(self, r):
+        q = maximum(1.0 - 1.0/self.epsilon*r, 0.)
+        result = -2.0*q/(self.epsilon*maximum(r, 1e-300))
+        result[r == 0] = 0
+        return result
+
+    def _d_wendland_c2(self, r):
+        q = maximum(1.0 - 1.0/self.epsilon*r, 0.)
+        return -20.0*q**3/self.epsilon**2
+
+    def _d_wendland_c4(self, r):
+        q = maximum(1.0 - 1.0/self.epsilon*r, 0.)
+        return -56.0*q**5*(5.0/self.epsilon*r + 1)/(3.0*self.epsilon**2)
+
     # Setup self._function and do smoke test on initial r
     def _init_function(self, r):
         if isinstance(self.function, str):
@@ -171,35 +255,675 @@ class Rbf_poly_bias(object):
         if self.k is None:
             self.k = (1, 1, 1)
         self.norm = kwargs.pop('norm', self._norm)
-        rss = self._call_norm(self.xs, self.xs)
         self.epsilon = kwargs.pop('epsilon', None)
-        if self.epsilon is None:
-            self.epsilon = rss.mean()
+
+        #The default epsilon depends on the structural nodes, which matters for the derivatives
+        self._default_epsilon = self.epsilon is None
 
         self.function = kwargs.pop('function', None)
         if self.function is None:
             self.function = 'multiquadric'
 
+        #Method used to solve the RBF system: 'inverse' (explicit inverses),
+        #'lu' (LU factorization of the augmented system), 'cholesky'
+        #(Cholesky factorization of the kernel matrix, positive definite kernels only),
+        #'sparse' (sparse LU, compactly supported kernels only, H is a scipy.sparse matrix)
+        #or 'krylov' (preconditioned GMRES, the kernel matrices are never formed and H is an operator)
+        self.solver = kwargs.pop('solver', 'inverse')
+        if self.solver not in ('inverse', 'lu', 'cholesky', 'sparse', 'krylov'):
+            raise ValueError("solver must be one of inverse, lu, cholesky, sparse, krylov")
+
+        #Krylov solver: relative tolerance and maximum number of iterations of GMRES,
+        #and number of nodes of the patches of the block-Jacobi preconditioner
+        self.krylov_tol = kwargs.pop('krylov_tol', 1e-10)
+        self.krylov_maxiter = kwargs.pop('krylov_maxiter', 500)
+        self.krylov_patch = kwargs.pop('krylov_patch', 500)
+
+        #Memory budget (bytes) for the temporaries of the distance and kernel evaluations
+        self.memory_budget = kwargs.pop('memory_budget', 2**27)
+
+        #Greedy data reduction (Rendall and Allen): tolerance on the relative interpolation error
+        #of the nodes that are not selected as centres (None: all the nodes are centres),
+        #nodal fields used to measure that error (quadratic fields of the coordinates by default)
+        #and maximum number of centres
+        self.reduction_tol = kwargs.pop('reduction_tol', None)
+        self.reduction_fields = kwargs.pop('reduction_fields', None)
+        self.max_centres = kwargs.pop('max_centres', None)
+
+        #Automatic epsilon (epsilon='auto'): nodal fields of the leave-one-out cross-validation
+        #(quadratic fields of the coordinates by default) and maximum number of nodes used in it
+        self.cv_fields = kwargs.pop('cv_fields', None)
+        self.cv_nodes = kwargs.pop('cv_nodes', 2000)
+
+        #Number of threads for the distance and kernel evaluations, also used as the limit of BLAS threads
+        #(None: serial evaluations and no limit)
+        self.n_threads = kwargs.pop('n_threads', None)
+        self._pool = None
+
+        #Out-of-core H: path of the .npy file where H is assembled by blocks of rows (dense solvers only),
+        #H is then an OutOfCoreMatrix that streams the file within the memory budget (None: H in memory)
+        self.out_of_core = kwargs.pop('out_of_core', None)
+        if self.out_of_core is not None and self.solver in ('sparse', 'krylov'):
+            raise ValueError("The out-of-core H is not available with the " + self.solver + " solver, whose H is an operator")
+
         # attach anything left in kwargs to self
         #  for use by any user-callable function or
         #  to save on the object returned.
         for item, value in kwargs.items():
             setattr(self, item, value)
 
-        ras = self._call_norm(self.xa, self.xs)
+        with _blas_threads(self.n_threads):
+            if isinstance(self.epsilon, str) and self.epsilon == 'auto':
+                self._select_epsilon()
+
+            if self.reduction_tol is not None:
+                self._select_centres()
+
+            #Structural operator (depends only on the structural centres)
+            if self.solver == 'sparse':
+                self._build_sparse()
+            elif self.solver == 'krylov':
+                self._build_krylov()
+            else:
+                self._build_dense()
+
+            #Evaluation on the aerodynamic points
+            self._build_target()
+
+
+    #Recompute H for new aerodynamic points, reusing the factorization of the structural system
+    def update_target(self, *args):
+        if len(args) != self.d:
+            raise ValueError("Output and input points must have the same dimension")
+        self.xa = asarray([asarray(a, dtype=float_).flatten() for a in args])
+        self.Na = self.xa.shape[-1]
+
+        if not all([x.size == self.xa[0].size for x in self.xa]):
+            raise ValueError("All output points arrays must be equal length.")
+
+        with _blas_threads(self.n_threads):
+            self._build_target()
+
+        return self.H
+
+
+    #Build H from the dense RBF system
+    def _build_dense(self):
+        nps = self.d + 1
+
+        #Kernel matrix of the structural centres, written directly into the augmented matrix for the LU solver
+        if self.solver == 'lu':
+            self._Css = zeros((nps + self.Ns, nps + self.Ns))
+            M = self._Css[nps:, nps:]
+        else:
+            M = empty((self.Ns, self.Ns))
+
+        #The default epsilon needs all the distances before evaluating the kernel
+        self._kernel_matrix(self.xs, self.xs, M, function=False)
+        if self.epsilon is None:
+            self.epsilon = M.mean()
+        self._apply_function(M)
 
-        #Matrix definition before assembling
-        self.M = self._init_function(rss)
-        self.Minv = linalg.inv(self.M)
         self.P = vstack((ones((1, self.Ns)), self.xs))
-        self.Mp = linalg.inv(self.P.dot(self.Minv).dot(transpose(self.P)))
-        Css_up = self.Mp.dot(self.P).dot(self.Minv)
-        Css_lo = self.Minv - self.Minv.dot(transpose(self.P)).dot(self.Mp).dot(self.P).dot(self.Minv)
-        self.Css_inv = vstack((Css_up, Css_lo))
 
-        self.Aas = hstack((ones((self.Na, 1)), transpose(self.xa), self._init_function(ras)))
+        if self.solver == 'inverse':
+            self.M = M
+            self.Minv = linalg.inv(self.M)
+            self.Mp = linalg.inv(self.P.dot(self.Minv).dot(transpose(self.P)))
+            Css_up = self.Mp.dot(self.P).dot(self.Minv)
+            Css_lo = self.Minv - self.Minv.dot(transpose(self.P)).dot(self.Mp).dot(self.P).dot(self.Minv)
+            self.Css_inv = vstack((Css_up, Css_lo))
+
+        else:
+            #Factorize the system once, without forming any inverse
+            self._factorize(M)
+
+
+    #Build the matrix of the aerodynamic points, Aas = [1, xa, A], and H = Aas Css^-1 [0 I]^T
+    def _build_target(self):
+        nps = self.d + 1
+
+        if self.solver == 'sparse':
+            pairs = cKDTree(transpose(self._sk*self.xa)).sparse_distance_matrix(self._tree_s, self.epsilon, output_type='ndarray')
+            A = sparse.coo_matrix((self._eval_function(pairs['v']), (pairs['i'], pairs['j'])), shape=(self.Na, self.Ns))
+            self.Aas = sparse.hstack((ones((self.Na, 1)), transpose(self.xa), A), format='csr')
+
+            #H is dense even if M and Aas are sparse, so it is kept in factored form
+            if getattr(self, '_operator', None) is None:
+                self._operator = SparseRbfOperator(self.M, self.P, self.Aas)
+            else:
+                self._operator = self._operator.retarget(self.Aas)
+            self.H = self._operator
+
+        elif self.solver == 'krylov':
+            #Neither Aas nor H are formed, the kernel products are evaluated by blocks
+            self.Aas = None
+            if getattr(self, '_operator', None) is None:
+                self._operator = KrylovRbfOperator(self, self.xa, tol=self.krylov_tol, maxiter=self.krylov_maxiter, patch_size=self.krylov_patch)
+            else:
+                self._operator = self._operator.retarget(self.xa)
+            self.H = self._operator
+
+        elif self.out_of_core is not None:
+            #Neither Aas nor H are formed in memory
+            from aerostructures.data_transfer.out_of_core import write_row_blocks
+            self.Aas = None
+            self._Yp = None
+            self.H = write_row_blocks(self.out_of_core, (self.Na, getattr(self, 'Ns_all', self.Ns)), self._target_blocks(), memory_budget=self.memory_budget)
+            return
+
+        else:
+            self.Aas = empty((self.Na, nps + self.Ns))
+            self.Aas[:, 0] = 1.
+            self.Aas[:, 1:nps] = transpose(self.xa)
+            self._kernel_matrix(self.xa, self.xs, self.Aas[:, nps:])
+
+            if self.solver == 'inverse':
+                self.H = self.Aas.dot(self.Css_inv)
+                self._Yp = None
+            else:
+                #Z = Css^-1 Aas^T, H^T = [0 I] Z since Css is symmetric (the polynomial rows are kept for the derivatives)
+                Z = self._solve_aug(transpose(self.Aas))
+                self._Yp = Z[:nps]
+                self.H = transpose(Z[nps:])
+
+        #Expand H to all the structural nodes (zero weights for the nodes that are not centres)
+        if self.reduction_tol is not None:
+            self._expand_centres()
+
+
+    #Structure of the matrix-free system: default epsilon and polynomial terms (the preconditioner is built with the operator)
+    def _build_krylov(self):
+        if self.epsilon is None:
+            self.epsilon = self._mean_distance(self.xs)
+
+        self.P = vstack((ones((1, self.Ns)), self.xs))
+
+
+    #Rows of H by blocks of aerodynamic points, expanded to all the structural nodes if there is a data reduction
+    def _target_blocks(self):
+        nps = self.d + 1
+        n_rows = self._block_rows(self.Ns)
+
+        for i in range(0, self.Na, n_rows):
+            xa = self.xa[:, i:i+n_rows]
+            Aas = empty((xa.shape[-1], nps + self.Ns))
+            Aas[:, 0] = 1.
+            Aas[:, 1:nps] = transpose(xa)
+            self._kernel_matrix(xa, self.xs, Aas[:, nps:])
+
+            if self.solver == 'inverse':
+                H = Aas.dot(self.Css_inv)
+            else:
+                H = transpose(self._solve_aug(transpose(Aas))[nps:])
+
+            if self.reduction_tol is not None:
+                H_all = zeros((H.shape[0], self.Ns_all))
+                H_all[:, self.centres] = H
+                H = H_all
+
+            yield H
+
+
+    #Build H as a sparse operator from a compactly supported function, looking for the neighbours of each point with a KD-tree
+    def _build_sparse(self):
+        if not (isinstance(self.function, str) and self.function.lower().startswith('wendland')):
+            raise ValueError("The sparse solver requires a compactly supported function (wendland_c0, wendland_c2 or wendland_c4)")
+
+        if self.epsilon is None:
+            raise ValueError("The support radius (epsilon) must be given for the sparse solver")
+
+        if self.norm != self._norm:
+            raise ValueError("The sparse solver only supports the biased euclidean norm")
+
+        #Scale the coordinates so that the biased norm becomes the euclidean norm
+        self._sk = sqrt(asarray(self.k, dtype=float_))[:, newaxis]
+        self._tree_s = cKDTree(transpose(self._sk*self.xs))
+
+        #Sparse kernel matrix of the structural centres (only the pairs within the support radius)
+        pairs = self._tree_s.sparse_distance_matrix(self._tree_s, self.epsilon, output_type='ndarray')
+        self.M = sparse.csc_matrix((self._eval_function(pairs['v']), (pairs['i'], pairs['j'])), shape=(self.Ns, self.Ns))
+
+        self.P = vstack((ones((1, self.Ns)), self.xs))
+
+
+    #Greedy selection of the RBF centres: starting from the extreme nodes, the node with the largest
+    #interpolation error is added until the error on the remaining nodes is below reduction_tol.
+    #Adding a centre p updates the interpolant with the residual kernel of the current centres,
+    #N(x) = k(x, p) - a(x)^T Css^-1 a(p), built recursively (Newton basis), so each step costs O(Ns n).
+    def _select_centres(self):
+        nps = self.d + 1
+        xs = self.xs
+        Ns = self.Ns
+
+        #The default epsilon is the mean distance between all the nodes, as in the full build
+        if self.epsilon is None:
+            self.epsilon = self._mean_distance(xs)
+
+        #Fields whose interpolation error drives the selection
+        F = self._test_fields(self.reduction_fields)
+
+        max_centres = Ns if self.max_centres is None else min(int(self.max_centres), Ns)
+
+        #Seed centres: extreme nodes along each direction
+        sel = []
+        for i in range(self.d):
+            for j in (xs[i].argmin(), xs[i].argmax()):
+                if j not in sel:
+                    sel.append(j)
+        n = len(sel)
+
+        #Terms a(x) = [1, x, k(x, seeds)] of all the nodes and augmented system of the seed centres
+        A0 = empty((Ns, nps + n))
+        A0[:, :nps] = transpose(vstack((ones((1, Ns)), xs)))
+        self._kernel_matrix(xs, xs[:, sel], A0[:, nps:])
+
+        C = zeros((nps + n, nps + n))
+        C[:nps, nps:] = transpose(A0[sel, :nps])
+        C[nps:, :nps] = A0[sel, :nps]
+        C[nps:, nps:] = A0[sel, nps:]
+        try:
+            B0 = transpose(linalg.solve(C, transpose(A0)))
+        except linalg.LinAlgError:
+            raise ValueError("The seed centres of the data reduction do not define a " + str(self.d) + "-dimensional polynomial")
+
+        #Interpolation error of the fields on all the nodes with the seed centres
+        e = F - B0[:, nps:].dot(F[sel])
+        e[sel] = 0.
+
+        #Scaled residual kernels of the added centres (columns) and their signs
+        V = empty((Ns, min(Ns, 256)), order='F')
+        sgn = empty(V.shape[1])
+        m = 0
+
+        while True:
+            err = absolute(e).max(axis=1)
+            p = err.argmax()
+            if err[p] <= self.reduction_tol or n >= max_centres:
+                break
+
+            #Residual kernel of the new centre
+            N = empty(Ns)
+            self._kernel_matrix(xs, xs[:, p:p+1], N[:, newaxis])
+            N -= B0.dot(A0[p])
+            if m > 0:
+                N -= V[:, :m].dot(sgn[:m]*V[p, :m])
+            s = N[p]
+
+            #Update the error of the fields
+            e -= N[:, newaxis]*(e[p]/s)
+            e[p] = 0.
+
+            if m == V.shape[1]:
+                V_new = empty((Ns, min(Ns, 2*m)), order='F')
+                V_new[:, :m] = V
+                V = V_new
+                sgn = hstack((sgn, empty(V.shape[1] - m)))
+            V[:, m] = N/sqrt(absolute(s))
+            sgn[m] = 1. if s > 0. else -1.
+            m += 1
+
+            sel.append(p)
+            n += 1
+
+        #Selected centres, achieved relative error on the remaining nodes and full set of nodes
+        self.centres = asarray(sorted(sel))
+        self.n_centres = n
+        self.reduction_error = err[p]
+
+        self.xs_all = xs
+        self.Ns_all = Ns
+        self.xs = xs[:, self.centres]
+        self.Ns = n
+
+
+    #Nodal fields used to measure interpolation errors (quadratic fields of the coordinates by default), scaled by their range
+    def _test_fields(self, fields):
+        xs = self.xs
+        if fields is None:
+            xn = (xs - xs.mean(axis=1)[:, newaxis])/(xs.max(axis=1) - xs.min(axis=1)).max()
+            F = transpose(asarray([xn[i]*xn[j] for i in range(self.d) for j in range(i, self.d)]))
+        else:
+            F = asarray(fields, dtype=float_).reshape(self.Ns, -1)
+        scale = F.max(axis=0) - F.min(axis=0)
+        scale[scale == 0.] = 1.
+
+        return F/scale
+
+
+    #Automatic epsilon: minimum of the leave-one-out error of the test fields (Rippa's closed form for the augmented
+    #system, e_k = c_k/(Css^-1)_kk), found with a bounded 1-D search on log(epsilon). Each candidate costs one LU factorization
+    #of the system of (at most cv_nodes) nodes. The chosen epsilon is then fixed (it is not differentiated)
+    def _select_epsilon(self):
+        if isinstance(self.function, str):
+            self.epsilon = 1.
+            self._init_function(ones(1))
+            if self.function not in self._scaled_functions:
+                raise ValueError("The " + self.function + " function does not depend on epsilon")
+
+        nps = self.d + 1
+
+        #Nodes and test fields of the cross-validation
+        F = self._test_fields(self.cv_fields)
+        if self.Ns > self.cv_nodes:
+            idx = RandomState(0).choice(self.Ns, self.cv_nodes, replace=False)
+            F = F[idx]
+            xs = self.xs[:, idx]
+        else:
+            xs = self.xs
+        n = xs.shape[-1]
+
+        R = empty((n, n))
+        self._kernel_matrix(xs, xs, R, function=False)
+        r_mean = R.mean()
+
+        Css = zeros((nps + n, nps + n))
+        Css[:nps, nps:] = vstack((ones((1, n)), xs))
+        Css[nps:, :nps] = transpose(Css[:nps, nps:])
+
+        B = zeros((nps + n, n))
+        B[nps:] = eye(n)
+
+        curve = []
+
+        def loo_error(log_epsilon):
+            self.epsilon = exp(log_epsilon)
+            Css[nps:, nps:] = R
+            self._apply_function(Css[nps:, nps:])
+            try:
+                lu = linalg.lu_factor(Css, check_finite=False)
+            except (linalg.LinAlgError, ValueError):
+                error = inf
+            else:
+                #Columns of Css^-1 of the nodes, kernel coefficients of the fields and leave-one-out errors
+                G = linalg.lu_solve(lu, B, check_finite=False)[nps:]
+                e = G.dot(F)/diag(G)[:, newaxis]
+                error = sqrt((e**2).mean()) if all(isfinite(e)) else inf
+            curve.append((self.epsilon, error))
+            return error
+
+        result = optimize.minimize_scalar(loo_error, bounds=(log(1e-2*r_mean), log(1e1*r_mean)), method='bounded', options={'xatol': 1e-2})
+
+        #Chosen epsilon, its leave-one-out error and all the evaluations of the search, sorted by epsilon
+        self.epsilon = exp(result.x)
+        self.epsilon_error = result.fun
+        curve = asarray(curve)
+        self.epsilon_curve = curve[argsort(curve[:, 0])]
+
+    def _expand_centres(self):
+        if self.solver in ('sparse', 'krylov'):
+            S = sparse.csr_matrix((ones(self.Ns), (range(self.Ns), self.centres)), shape=(self.Ns, self.Ns_all))
+            self.H = self.H.dot(aslinearoperator(S))
+        else:
+            H = zeros((self.Na, self.Ns_all))
+            H[:, self.centres] = self.H
+            self.H = H
+
+
+    #Mean of the distances between all the pairs of points of x, computed by blocks of rows
+    def _mean_distance(self, x):
+        n_rows = self._block_rows(x.shape[-1])
+
+        def block(i):
+            return self._call_norm(x[:, i:i+n_rows], x).sum()
+
+        return sum(self._map_blocks(block, x.shape[-1], n_rows))/x.shape[-1]**2
+
+
+    #Number of rows of a block such that the temporaries of all the threads fit in the memory budget
+    def _block_rows(self, n_cols):
+        return max(1, int(self.memory_budget//(8*(self.d + 3)*max(1, n_cols)*max(1, self.n_threads or 1))))
+
+
+    #Apply func to the starting rows of the blocks of n_rows rows of a matrix of n rows. With n_threads > 1,
+    #the blocks are processed by a thread pool (NumPy releases the GIL in the array operations), which is created
+    #on the first call and kept by the instance (the krylov operator maps blocks on every product)
+    def _map_blocks(self, func, n, n_rows):
+        starts = list(range(0, n, n_rows))
+        if self.n_threads is None or self.n_threads <= 1 or len(starts) <= 1:
+            return [func(i) for i in starts]
 
-        self.H = self.Aas.dot(self.Css_inv)
+        #The first block is processed alone, since it sets up the RBF function
+        results = [func(starts[0])]
+        if self._pool is None:
+            self._pool = ThreadPool(self.n_threads)
+        results += self._pool.map(func, starts[1:])
+
+        return results
+
+
+    #Close the thread pool of the block evaluations
+    def __del__(self):
+        if getattr(self, '_pool', None) is not None:
+            self._pool.close()
+            self._pool = None
+
+
+    #Product of the kernel matrix between the points x1 and x2 with V, evaluated by blocks of rows (the matrix is never formed)
+    def _kernel_dot(self, x1, x2, V):
+        n_rows = self._block_rows(x2.shape[-1])
+        out = empty((x1.shape[-1],) + V.shape[1:])
+
+        def block(i):
+            out[i:i+n_rows] = self._eval_function(self._call_norm(x1[:, i:i+n_rows], x2)).dot(V)
+
+        self._map_blocks(block, x1.shape[-1], n_rows)
+
+        return out
+
+
+    #Evaluate the distances (and the RBF function) between the points x1 and x2 by blocks of rows,
+    #writing the values directly into disjoint slices of the preallocated matrix out
+    def _kernel_matrix(self, x1, x2, out, function=True):
+        n_rows = self._block_rows(x2.shape[-1])
+
+        def block(i):
+            r = self._call_norm(x1[:, i:i+n_rows], x2)
+            if function:
+                r = self._eval_function(r)
+            out[i:i+n_rows] = r
+
+        self._map_blocks(block, x1.shape[-1], n_rows)
+
+        return out
+
+
+    #Apply the RBF function in place to a matrix of distances, by blocks of rows
+    def _apply_function(self, out):
+        n_rows = self._block_rows(out.shape[-1])
+
+        def block(i):
+            out[i:i+n_rows] = self._eval_function(out[i:i+n_rows])
+
+        self._map_blocks(block, out.shape[0], n_rows)
+
+        return out
+
+
+    #Evaluate the RBF function, setting it up on the first call
+    def _eval_function(self, r):
+        if not hasattr(self, '_function'):
+            return self._init_function(r)
+
+        return self._function(r)
+
+
+    #Factorize the augmented RBF system Css = [[0, P], [P^T, M]] without forming any inverse
+    def _factorize(self, M):
+        nps = self.d + 1
+
+        #Both matrices are symmetric, so their transposes (Fortran ordered) are factorized in place
+        if self.solver == 'cholesky':
+            try:
+                self._cho = linalg.cho_factor(transpose(M), lower=True, overwrite_a=True, check_finite=False)
+            except linalg.LinAlgError:
+                raise ValueError("The kernel matrix is not positive definite, use solver='lu' with the " + str(self.function) + " function")
+
+            #Schur complement of the polynomial block, S = P M^-1 P^T
+            self._W = linalg.cho_solve(self._cho, transpose(self.P), check_finite=False)
+            self._S = linalg.cho_factor(self.P.dot(self._W), lower=True, check_finite=False)
+
+        else:
+            Css = self._Css
+            del self._Css
+            Css[:nps, nps:] = self.P
+            Css[nps:, :nps] = transpose(self.P)
+
+            self._lu = linalg.lu_factor(transpose(Css), overwrite_a=True, check_finite=False)
+
+
+    #Solve Css X = B using the factorization of the augmented system
+    def _solve_aug(self, B):
+        nps = self.d + 1
+
+        if self.solver == 'cholesky':
+            y = linalg.cho_solve(self._cho, B[nps:], check_finite=False)
+            beta = linalg.cho_solve(self._S, self.P.dot(y) - B[:nps], check_finite=False)
+
+            #gamma = y - W beta, updated in place
+            gamma = linalg.blas.dgemm(-1., self._W, beta, 1., y, overwrite_c=True)
+            return vstack((beta, gamma))
+
+        elif self.solver == 'inverse':
+            #Css^-1 = [[-Mp, Css_up], [Css_up^T, Css_lo]] and Css_inv = [Css_up; Css_lo]
+            X = self.Css_inv.dot(B[nps:])
+            X[:nps] -= self.Mp.dot(B[:nps])
+            X[nps:] += transpose(self.Css_inv[:nps]).dot(B[:nps])
+            return X
+
+        else:
+            return linalg.lu_solve(self._lu, B, check_finite=False)
+
+
+    #Derivative terms of the RBF function, phi'(r)/r and dphi/depsilon
+    def _eval_derivative(self, r):
+        D = self._d_function(r)
+        if self.function in self._scaled_functions:
+            E = -r**2*D/self.epsilon
+        else:
+            E = zeros(r.shape)
+
+        return D, E
+
+
+    #Check that H can be differentiated and set up the derivatives of the function
+    def _init_derivatives(self):
+        if self.solver == 'sparse' or self.reduction_tol is not None:
+            raise ValueError("The derivatives of H are only available for the dense solvers without data reduction")
+
+        if self.norm != self._norm:
+            raise ValueError("The derivatives of H are only available for the biased euclidean norm")
+
+        if not (isinstance(self.function, str) and hasattr(self, '_d_' + self.function)):
+            raise ValueError("The derivatives of H are not available for the " + str(self.function) + " function")
+        self._d_function = getattr(self, '_d_' + self.function)
+
+        #Polynomial rows of Css^-1 Aas^T, Yp = [-Mp, Css_up] Aas^T for the inverse solver
+        if self._Yp is None:
+            nps = self.d + 1
+            self._Yp = self.Css_inv[:nps].dot(transpose(self.Aas[:, nps:])) - self.Mp.dot(transpose(self.Aas[:, :nps]))
+
+        return self._Yp
+
+
+    #Sum over the pairs of points x1, x2 of the distance terms k (x1 - x2) Q, by columns of x1 and x2
+    def _pair_sums(self, x1, x2, Q):
+        k = asarray(self.k, dtype=float_)[:, newaxis]
+        return k*(x1*Q.sum(axis=1) - x2.dot(transpose(Q))), -k*(x1.dot(Q) - x2*Q.sum(axis=0))
+
+
+    #Derivative of the distance r(x1, x2) along (dx1, dx2), times r
+    def _pair_jvp(self, x1, x2, dx1, dx2):
+        k = asarray(self.k, dtype=float_)
+        return einsum('c,cij,cij->ij', k, x1[:, :, newaxis] - x2[:, newaxis, :], dx1[:, :, newaxis] - dx2[:, newaxis, :])
+
+
+    #Jacobian-vector product of H with respect to the structural nodes (dxs) and the aerodynamic points (dxa):
+    #dH^T = [0 I] Css^-1 (dAas^T - dCss Z), with Z = Css^-1 Aas^T = [Yp; H^T]
+    def jvp(self, dxs=None, dxa=None):
+        Yp = self._init_derivatives()
+        nps = self.d + 1
+        xs = self.xs
+        xa = self.xa
+
+        dxs = zeros(xs.shape) if dxs is None else asarray(dxs, dtype=float_).reshape(xs.shape)
+        dxa = zeros(xa.shape) if dxa is None else asarray(dxa, dtype=float_).reshape(xa.shape)
+
+        #Derivative of the default epsilon (mean distance between the structural nodes)
+        deps = 0.
+        if self._default_epsilon:
+            n_rows = self._block_rows(2*self.Ns)
+            for j in range(0, self.Ns, n_rows):
+                r = self._call_norm(xs[:, j:j+n_rows], xs)
+                r[r == 0] = 1.
+                deps += (self._pair_jvp(xs[:, j:j+n_rows], xs, dxs[:, j:j+n_rows], dxs)/r).sum()
+            deps /= self.Ns**2
+
+        #Polynomial terms of the right hand side
+        B = zeros((nps + self.Ns, self.Na))
+        B[1:nps] = dxa - dxs.dot(transpose(self.H))
+        B[nps:] = -transpose(dxs).dot(Yp[1:])
+
+        #Kernel terms of the aerodynamic points, dA^T, by blocks of aerodynamic points
+        n_rows = self._block_rows(2*self.Ns)
+        for i in range(0, self.Na, n_rows):
+            D, E = self._eval_derivative(self._call_norm(xa[:, i:i+n_rows], xs))
+            B[nps:, i:i+n_rows] += transpose(D*self._pair_jvp(xa[:, i:i+n_rows], xs, dxa[:, i:i+n_rows], dxs) + E*deps)
+
+        #Kernel terms of the structural nodes, -dM H^T, by blocks of structural nodes
+        for j in range(0, self.Ns, n_rows):
+            D, E = self._eval_derivative(self._call_norm(xs[:, j:j+n_rows], xs))
+            B[nps+j:nps+j+n_rows] -= (D*self._pair_jvp(xs[:, j:j+n_rows], xs, dxs[:, j:j+n_rows], dxs) + E*deps).dot(transpose(self.H))
+
+        return transpose(self._solve_aug(B)[nps:])
+
+
+    #Vector-Jacobian product of H: gradients with respect to the structural nodes and the aerodynamic points
+    #of <H_bar, H>, from R = Css^-1 [0 I]^T H_bar^T, Aas_bar = R^T and Css_bar = -Z R^T
+    def vjp(self, H_bar):
+        Yp = self._init_derivatives()
+        nps = self.d + 1
+        xs = self.xs
+        xa = self.xa
+
+        B = zeros((nps + self.Ns, self.Na))
+        B[nps:] = transpose(asarray(H_bar, dtype=float_).reshape(self.Na, self.Ns))
+        R = self._solve_aug(B)
+        Rp = R[:nps]
+        Rs = R[nps:]
+
+        xa_bar = Rp[1:].copy()
+        eps_bar = 0.
+
+        #Polynomial terms of Css
+        xs_bar = -Yp[1:].dot(transpose(Rs)) - Rp[1:].dot(self.H)
+
+        #Kernel terms of the aerodynamic points, A_bar = Rs^T
+        n_rows = self._block_rows(2*self.Ns)
+        for i in range(0, self.Na, n_rows):
+            A_bar = transpose(Rs[:, i:i+n_rows])
+            D, E = self._eval_derivative(self._call_norm(xa[:, i:i+n_rows], xs))
+            eps_bar += (A_bar*E).sum()
+            dxa_i, dxs_i = self._pair_sums(xa[:, i:i+n_rows], xs, A_bar*D)
+            xa_bar[:, i:i+n_rows] += dxa_i
+            xs_bar += dxs_i
+
+        #Kernel terms of the structural nodes, M_bar = -H^T Rs^T (both arguments of each kernel entry)
+        for j in range(0, self.Ns, n_rows):
+            M_bar = -transpose(self.H[:, j:j+n_rows]).dot(transpose(Rs))
+            D, E = self._eval_derivative(self._call_norm(xs[:, j:j+n_rows], xs))
+            eps_bar += (M_bar*E).sum()
+            xs_bar[:, j:j+n_rows] += self._pair_sums(xs[:, j:j+n_rows], xs, (M_bar - Rs[j:j+n_rows].dot(self.H))*D)[0]
+
+        #Default epsilon, mean distance between the structural nodes
+        if self._default_epsilon:
+            for j in range(0, self.Ns, n_rows):
+                r = self._call_norm(xs[:, j:j+n_rows], xs)
+                Q = zeros(r.shape)
+                Q[r > 0] = 2.*eps_bar/(self.Ns**2*r[r > 0])
+                xs_bar[:, j:j+n_rows] += self._pair_sums(xs[:, j:j+n_rows], xs, Q)[0]
+
+        return xs_bar, xa_bar
 
 
     def _call_norm(self, x1, x2):
@@ -218,10 +942,249 @@ class Rbf_poly_bias(object):
             raise ValueError("Array lengths must be equal")
         us = asarray([a.flatten() for a in args], dtype=float_)
 
-        if self.xs.shape != us.shape:
+        if getattr(self, 'xs_all', self.xs).shape != us.shape:
             raise ValueError("Points and values vectors must have the same shape")
 
         u_s = us.transpose()
 
         u_a = self.H.dot(u_s)
         return u_a
+
+
+
+class SparseRbfOperator(LinearOperator):
+    """
+    Interpolation matrix H = Aas Css^-1 [0 I]^T of a compactly supported RBF,
+    kept in factored form: the sparse kernel matrix M is factorized once and the
+    polynomial block is eliminated through its (d+1)x(d+1) Schur complement.
+
+    H.dot(u) and H.T.dot(f) cost a few sparse triangular solves instead of a
+    dense (Na x Ns) product. tocsr() returns an explicit (thresholded) matrix.
+    """
+
+    def __init__(self, M, P, Aas):
+        self.P = P
+        self.Aas = Aas
+        self.nps = P.shape[0]
+
+        #Sparse LU factorization of the kernel matrix (symmetric ordering)
+        self._splu = splu(sparse.csc_matrix(M), permc_spec='MMD_AT_PLUS_A')
+
+        #Schur complement of the polynomial block, S = P M^-1 P^T
+        self._W = self._splu.solve(transpose(P).copy())
+        self._S = linalg.cho_factor(P.dot(self._W), lower=True, check_finite=False)
+
+        super(SparseRbfOperator, self).__init__(dtype=float_, shape=(Aas.shape[0], M.shape[0]))
+
+    #Operator for a new matrix of aerodynamic points, sharing the factorization
+    def retarget(self, Aas):
+        op = copy.copy(self)
+        op.Aas = Aas
+        op.shape = (Aas.shape[0], self.shape[1])
+
+        return op
+
+    #Solve Css X = [B1; B2] for X = [beta; gamma]
+    def _solve_aug(self, B1, B2):
+        y = self._splu.solve(asarray(B2, dtype=float_))
+        beta = linalg.cho_solve(self._S, self.P.dot(y) - B1, check_finite=False)
+        return beta, y - self._W.dot(beta)
+
+    def _matmat(self, U):
+        beta, gamma = self._solve_aug(zeros((self.nps, U.shape[1])), U)
+        return self.Aas.dot(vstack((beta, gamma)))
+
+    def _rmatmat(self, F):
+        B = self.Aas.T.dot(F)
+        return self._solve_aug(B[:self.nps], B[self.nps:])[1]
+
+    def _matvec(self, u):
+        return self._matmat(asarray(u).reshape(-1, 1)).reshape(-1)
+
+    def _rmatvec(self, f):
+        return self._rmatmat(asarray(f).reshape(-1, 1)).reshape(-1)
+
+    def _adjoint(self):
+        return _TransposedOperator(self)
+
+    _transpose = _adjoint
+
+    #Explicit sparse H, dropping the weights smaller than drop_tol times the largest weight of each row
+    def tocsr(self, drop_tol=1e-8, n_rows=1024):
+        H_blocks = []
+        for i in range(0, self.shape[0], n_rows):
+            H_block = self._rows(i, i+n_rows)
+            H_block[absolute(H_block) < drop_tol*absolute(H_block).max(axis=1)[:, newaxis]] = 0.
+            H_blocks.append(sparse.csr_matrix(H_block))
+
+        return sparse.vstack(H_blocks, format='csr')
+
+    #Dense rows i0:i1 of H
+    def _rows(self, i0, i1):
+        B = self.Aas[i0:i1].T.toarray()
+        return transpose(self._solve_aug(B[:self.nps], B[self.nps:])[1])
+
+
+class KrylovRbfOperator(LinearOperator):
+    """
+    Interpolation matrix H = Aas Css^-1 [0 I]^T of an RBF whose kernel
+    matrices are never formed: the products with the kernel matrices are
+    evaluated by blocks of rows within the memory budget of the RBF, and the
+    augmented system Css x = b is solved by GMRES for each field.
+
+    The preconditioner is block diagonal: a restricted additive Schwarz
+    approximation of M^-1 for the RBF block (the nodes are clustered into
+    cores of patch_size/overlap nodes, each core is extended to its
+    patch_size nearest nodes, and the solution of the kernel system of the
+    extended patch is kept on the core) and the Schur complement
+    -P M_ras^-1 P^T for the polynomial block. The last solutions are used as
+    initial guesses of the next solves. A RuntimeError is raised if GMRES
+    does not converge within maxiter iterations.
+    """
+
+    def __init__(self, rbf, xa, tol=1e-10, maxiter=500, patch_size=500, overlap=4):
+        from aerostructures.data_transfer.block_low_rank import _cluster
+
+        self.rbf = rbf
+        self.xa = xa
+        self.tol = tol
+        self.maxiter = maxiter
+        self.nps = rbf.P.shape[0]
+        Ns = rbf.Ns
+        patch_size = min(patch_size, Ns)
+
+        #Cores of nearby nodes, their extended patches and the factorizations of the kernel matrices of the patches
+        perm, leaves = _cluster(transpose(rbf.xs), max(1, patch_size//overlap))
+        tree = cKDTree(transpose(rbf.xs))
+        self.cores = []
+        self.patches = []
+        self._lu = []
+        for i0, i1 in leaves:
+            core = perm[i0:i1]
+            patch = tree.query(rbf.xs[:, core].mean(axis=1), patch_size)[1]
+            patch = hstack((core, patch[~(patch[:, newaxis] == core).any(axis=1)]))
+            M_p = rbf._eval_function(rbf._call_norm(rbf.xs[:, patch], rbf.xs[:, patch]))
+
+            self.cores.append(core)
+            self.patches.append(patch)
+            self._lu.append(linalg.lu_factor(M_p, check_finite=False))
+
+        #Schur complement of the polynomial block with the Schwarz approximation of M
+        self._W = self._precondition_rbf(transpose(rbf.P))
+        self._S = linalg.lu_factor(-rbf.P.dot(self._W), check_finite=False)
+
+        self._system = LinearOperator((self.nps + Ns, self.nps + Ns), matvec=self._system_dot, dtype=float_)
+        self._precond = LinearOperator((self.nps + Ns, self.nps + Ns), matvec=self._precondition, dtype=float_)
+
+        #Last solutions of the solves of each kind and column (initial guesses) and iterations of the last solve
+        self._x0 = {}
+        self.iterations = 0
+
+        super(KrylovRbfOperator, self).__init__(dtype=float_, shape=(xa.shape[-1], Ns))
+
+    #Operator for new aerodynamic points, sharing the preconditioner
+    def retarget(self, xa):
+        op = copy.copy(self)
+        op.xa = xa
+        op.shape = (xa.shape[-1], self.shape[1])
+
+        return op
+
+    #Product of the augmented matrix Css = [[0, P], [P^T, M]] with x = [beta; gamma]
+    def _system_dot(self, x):
+        rbf = self.rbf
+        x = asarray(x).reshape(-1)
+        beta, gamma = x[:self.nps], x[self.nps:]
+
+        return hstack((rbf.P.dot(gamma), transpose(rbf.P).dot(beta) + rbf._kernel_dot(rbf.xs, rbf.xs, gamma)))
+
+    #Restricted additive Schwarz approximation of M^-1 B (the solution of each patch is kept on its core)
+    def _precondition_rbf(self, B):
+        X = empty(B.shape)
+        for core, patch, lu in zip(self.cores, self.patches, self._lu):
+            X[core] = linalg.lu_solve(lu, B[patch], check_finite=False)[:len(core)]
+
+        return X
+
+    def _precondition(self, r):
+        r = asarray(r).reshape(-1)
+        return hstack((linalg.lu_solve(self._S, r[:self.nps], check_finite=False), self._precondition_rbf(r[self.nps:])))
+
+    #Solve Css X = B column by column, starting from the last solutions of the same kind
+    def _solve_aug(self, B, kind):
+        X = empty(B.shape)
+        self.iterations = 0
+        for j in range(B.shape[1]):
+            counter = [0]
+
+            def callback(res):
+                counter[0] += 1
+
+            x0 = self._x0.get((kind, j))
+            #maxiter of GMRES counts the restart cycles
+            options = dict(x0=x0, restart=50, maxiter=max(1, self.maxiter//50), M=self._precond, callback=callback)
+            #The tolerance argument was renamed in SciPy 1.12
+            try:
+                X[:, j], info = gmres(self._system, B[:, j], rtol=self.tol, callback_type='pr_norm', **options)
+            except TypeError:
+                X[:, j], info = gmres(self._system, B[:, j], tol=self.tol, **options)
+
+            #An unconverged solution is not a transfer of the field, so it is never returned (nor kept as initial guess)
+            if info != 0:
+                self._x0.pop((kind, j), None)
+                raise RuntimeError("GMRES did not reach the tolerance " + str(self.tol) + " in " + str(counter[0]) + " iterations: increase krylov_maxiter or krylov_patch, "
+                                   "or use a direct solver (lu, cholesky or sparse)")
+
+            self._x0[(kind, j)] = X[:, j].copy()
+            self.iterations += counter[0]
+
+        return X
+
+    def _matmat(self, U):
+        rbf = self.rbf
+        U = asarray(U, dtype=float_)
+        C = self._solve_aug(vstack((zeros((self.nps, U.shape[1])), U)), 'u')
+
+        return C[0] + transpose(self.xa).dot(C[1:self.nps]) + rbf._kernel_dot(self.xa, rbf.xs, C[self.nps:])
+
+    def _rmatmat(self, F):
+        rbf = self.rbf
+        F = asarray(F, dtype=float_)
+        B = vstack((F.sum(axis=0), self.xa.dot(F), rbf._kernel_dot(rbf.xs, self.xa, F)))
+
+        return self._solve_aug(B, 'f')[self.nps:]
+
+    def _matvec(self, u):
+        return self._matmat(asarray(u).reshape(-1, 1)).reshape(-1)
+
+    def _rmatvec(self, f):
+        return self._rmatmat(asarray(f).reshape(-1, 1)).reshape(-1)
+
+    def _adjoint(self):
+        return _TransposedOperator(self)
+
+    _transpose = _adjoint
+
+
+class _TransposedOperator(LinearOperator):
+
+    def __init__(self, A):
+        self.A = A
+        super(_TransposedOperator, self).__init__(dtype=A.dtype, shape=(A.shape[1], A.shape[0]))
+
+    def _matmat(self, F):
+        return self.A._rmatmat(F)
+
+    def _rmatmat(self, U):
+        return self.A._matmat(U)
+
+    def _matvec(self, f):
+        return self.A._rmatvec(f)
+
+    def _rmatvec(self, u):
+        return self.A._matvec(u)
+
+    def _adjoint(self):
+        return self.A
+
+    _transpose = _adjoint
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+RBF interpolation of several independent surfaces (e.g. wing, horizontal tail
+and fin).
+
+Each surface group is given by the indices of its aerodynamic points and of
+its structural nodes. An independent RBF interpolation with polynomial terms
+(Rbf_poly_bias) is built for each group, so the surfaces are not coupled and
+the cost is the sum of the cubes of the group sizes instead of the cube of the
+total number of nodes. The group problems can be solved in a process pool
+(n_procs > 1); on Windows, the calling script must then be protected by
+if __name__ == '__main__'.
+
+The resulting H is a block-sparse scipy.sparse matrix, with one dense block
+per group. Aerodynamic points that belong to no group have zero rows.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import multiprocessing
+
+import numpy as np
+
+from scipy import sparse
+
+from aerostructures.data_transfer.rbf_poly_bias import Rbf_poly_bias
+
+__all__ = ['Rbf_surfaces']
+
+
+#Interpolation of a surface group (module level function, so that it can be sent to a process pool)
+def _surface_interpolation(args):
+    xs, xa, kwargs = args
+
+    inter = Rbf_poly_bias(*(tuple(xs) + tuple(xa)), **kwargs)
+
+    return inter.H, inter.epsilon, getattr(inter, 'n_centres', None), getattr(inter, 'reduction_error', None)
+
+
+class Rbf_surfaces(object):
+
+    def __init__(self, *args, **kwargs):
+        if len(args)%2 != 0:
+            raise ValueError("Output and input points must have the same dimension")
+        self.d = int(len(args)/2)
+        self.xs = np.asarray([np.asarray(a, dtype=float).flatten() for a in args[:self.d]])
+        self.xa = np.asarray([np.asarray(a, dtype=float).flatten() for a in args[self.d:]])
+        self.Ns = self.xs.shape[-1]
+        self.Na = self.xa.shape[-1]
+
+        #Surface groups: list of (indices of the aerodynamic points, indices of the structural nodes)
+        surfaces = kwargs.pop('surfaces', None)
+        if not surfaces:
+            raise ValueError("At least one surface group is needed")
+        self.surfaces = [(np.asarray(a_idx, dtype=int).ravel(), np.asarray(s_idx, dtype=int).ravel()) for a_idx, s_idx in surfaces]
+
+        #Each aerodynamic point is interpolated from a single surface
+        a_all = np.hstack([a_idx for a_idx, s_idx in self.surfaces])
+        if len(np.unique(a_all)) != len(a_all):
+            raise ValueError("The surface groups must not share aerodynamic points")
+
+        #Number of processes used for the group problems
+        self.n_procs = kwargs.pop('n_procs', 1)
+
+        #Options of the interpolations of the groups (function, epsilon, solver...), H must be an array
+        if kwargs.get('solver') in ('sparse', 'krylov'):
+            raise ValueError("The surface groups are not available with the sparse and krylov solvers, whose H is an operator")
+        self.options = kwargs
+
+        self.H = self._assemble()
+
+
+    def _assemble(self):
+        #Nodal fields of the data reduction and of the automatic epsilon, restricted to the nodes of each group
+        tasks = []
+        for a_idx, s_idx in self.surfaces:
+            options = dict(self.options)
+            for name in ('reduction_fields', 'cv_fields'):
+                if options.get(name) is not None:
+                    options[name] = np.asarray(options[name], dtype=float).reshape(self.Ns, -1)[s_idx]
+            tasks.append((self.xs[:, s_idx], self.xa[:, a_idx], options))
+
+        if self.n_procs > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(self.n_procs, len(tasks)))
+            try:
+                results = pool.map(_surface_interpolation, tasks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_surface_interpolation(task) for task in tasks]
+
+        #Epsilon and data reduction results of each group
+        self.epsilon = [r[1] for r in results]
+        if self.options.get('reduction_tol') is not None:
+            self.n_centres = sum([r[2] for r in results])
+            self.reduction_error = max([r[3] for r in results])
+
+        #Assemble the blocks of the groups
+        rows = []
+        cols = []
+        vals = []
+        for (a_idx, s_idx), r in zip(self.surfaces, results):
+            H_g = np.asarray(r[0])
+            rows.append(np.repeat(a_idx, len(s_idx)))
+            cols.append(np.tile(s_idx, len(a_idx)))
+            vals.append(H_g.ravel())
+
+        return sparse.csr_matrix((np.hstack(vals), (np.hstack(rows), np.hstack(cols))), shape=(self.Na, self.Ns))
+
+
+    def __call__(self, *args):
+        args = [np.asarray(x) for x in args]
+        if not all([x.shape == y.shape for x in args for y in args]):
+            raise ValueError("Array lengths must be equal")
+        us = np.asarray([a.flatten() for a in args], dtype=float)
+
+        if self.xs.shape != us.shape:
+            raise ValueError("Points and values vectors must have the same shape")
+
+        return self.H.dot(us.transpose())
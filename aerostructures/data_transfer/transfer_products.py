@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Products of the transfer matrices with nodal fields, shared by the transfer
+components.
+
+The fields are either single fields (n x 3) or several load cases stacked
+along a leading dimension (n_cases x n x 3). The cases are laid side by side in
+the columns of a single (n x 3 n_cases) matrix, so each transfer is one GEMM
+with the transfer matrix instead of one product per case.
+
+Transfer matrices stored in single precision are upcast to double precision by
+blocks of rows, so that the products accumulate in double precision.
+"""
+
+from __future__ import print_function
+
+import warnings
+
+import numpy as np
+
+__all__ = ['batch_dot', 'batch_outer', 'check_precision', 'StoragePrecision']
+
+
+#Product of a single precision matrix A with X, upcasting A by blocks (memory_budget bytes) to accumulate in double precision
+def _mixed_dot(A, X, memory_budget=2**24):
+    m, n = A.shape
+    Y = np.zeros((m, X.shape[1]))
+
+    #Transposed matrix (e.g. H.T): the blocks are taken along the rows of the stored matrix
+    if A.flags.f_contiguous and not A.flags.c_contiguous:
+        B = A.T
+        n_rows = max(1, memory_budget//(8*m))
+        for j in range(0, n, n_rows):
+            Y += B[j:j+n_rows].astype(np.float64).T.dot(X[j:j+n_rows])
+
+    else:
+        n_rows = max(1, memory_budget//(8*n))
+        for i in range(0, m, n_rows):
+            Y[i:i+n_rows] = A[i:i+n_rows].astype(np.float64).dot(X)
+
+    return Y
+
+
+#Product of the matrix A (array, sparse matrix or operator) with the matrix X
+def _dot(A, X):
+    if isinstance(A, np.ndarray) and A.dtype == np.float32:
+        return _mixed_dot(A, X)
+
+    return A.dot(X)
+
+
+#Product A X of the matrix A (m x n) with the fields X (n x k or n_cases x n x k)
+def batch_dot(A, X):
+    X = np.asarray(X)
+    if X.ndim == 2:
+        return _dot(A, X)
+
+    n_cases, n, k = X.shape
+    Y = _dot(A, np.ascontiguousarray(np.transpose(X, (1, 0, 2))).reshape(n, n_cases*k))
+
+    return np.ascontiguousarray(np.transpose(np.asarray(Y).reshape(-1, n_cases, k), (1, 0, 2)))
+
+
+#Sum over the cases of the products Y X^T of the fields Y (m x k or n_cases x m x k) and X (n x k or n_cases x n x k)
+def batch_outer(Y, X):
+    Y = np.asarray(Y)
+    X = np.asarray(X)
+    if Y.ndim == 2:
+        return Y.dot(X.T)
+
+    return np.tensordot(Y, X, axes=([0, 2], [0, 2]))
+
+
+#Relative error of the transfer of the fields X (random fields by default) by the low precision matrix A_low
+#with respect to the double precision matrix A, with a warning if it is above tol
+def check_precision(A, A_low, X=None, tol=1e-6):
+    if X is None:
+        X = np.random.RandomState(0).rand(A.shape[1], 3)
+    Y = batch_dot(A, X)
+    error = np.linalg.norm(Y - batch_dot(A_low, X))/np.linalg.norm(Y)
+    if error > tol:
+        warnings.warn("The relative error of the transfer with the " + str(A_low.dtype) + " matrix is " + str(error) + " (tolerance " + str(tol) + ")")
+
+    return error
+
+
+#Storage of the transfer matrices in a lower precision (float32). Each new matrix is converted once
+#and the accuracy of its transfers is checked against the double precision matrix on first use
+class StoragePrecision(object):
+
+    def __init__(self, dtype=np.float32, tol=1e-6):
+        self.dtype = np.dtype(dtype)
+        self.tol = tol
+
+        #Last double precision matrix, its conversion and the relative error of the transfers
+        self._source = None
+        self._converted = None
+        self.error = 0.
+
+    def __call__(self, A):
+        #Matrices already in the storage precision and operators are used as they are
+        if not hasattr(A, 'astype') or A.dtype == self.dtype:
+            return A
+
+        if A is not self._source:
+            self._converted = A.astype(self.dtype)
+            self.error = check_precision(A, self._converted, tol=self.tol)
+            self._source = A
+
+        return self._converted
@@ -4,9 +4,11 @@
 
 from openmdao.api import Component
 
+from aerostructures.openmdao_tools.memoization import MemoizationMixin
+
 import numpy as np
 
-class CaeroPlanform(Component):
+class CaeroPlanform(MemoizationMixin, Component):
     
     def __init__(self, y):
         super(CaeroPlanform, self).__init__()
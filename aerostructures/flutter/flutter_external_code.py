@@ -10,20 +10,25 @@ import numpy as np
 
 import os
 import glob
-import time
-
 import re
 
-import math
-
 from pyNastran.op4.op4 import OP4
 
-from aerostructures import isint, isfloat, print_float_8
+from aerostructures import isfloat, print_float_8
+
+from aerostructures.openmdao_tools.wait_for_output import wait_for_output
 
 
 class Flutter(ExternalCode):
     template_file = 'flutter_input_template.bdf'
 
+    # Maximum time (s) to wait for the output file of the external code to be completed
+    output_timeout = 3600.
+
+    # Time (s) without changes of the output files before reading them (0: the external code has already exited, so they are complete;
+    # a positive time is only needed if the command launches the solver in the background)
+    output_settle = 0.
+
     output_file = 'nastran_flutter.f06'
 
     def __init__(self, N, F, n_sec, nm, node_id_all):
@@ -159,11 +164,7 @@ class Flutter(ExternalCode):
 
         # Read the output file only if it exists and its last modification date is older than input file one
 
-        while(not os.path.isfile(self.output_filepath)):
-            pass
-
-        while(os.path.getmtime(self.output_filepath) <= os.path.getmtime(self.input_filepath)):
-            pass
+        wait_for_output(self.output_filepath, self.input_filepath, timeout=self.output_timeout, settle=self.output_settle)
 
         N = self.N
 
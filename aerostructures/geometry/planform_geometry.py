@@ -8,7 +8,9 @@ import numpy as np
 
 from openmdao.api import Component
 
-class PlanformGeometry(Component):
+from aerostructures.openmdao_tools.memoization import MemoizationMixin
+
+class PlanformGeometry(MemoizationMixin, Component):
 
     def __init__(self, n_sec, b_sec):
         super(PlanformGeometry, self).__init__()
@@ -6,15 +6,19 @@ from __future__ import print_function
 
 import numpy as np
 
+from scipy import sparse
+
 from openmdao.api import Component
 
+from aerostructures.openmdao_tools.memoization import MemoizationMixin
+
 '''
 Component which takes the aerodynamic jig mesh coordinates and gives the coordinates of the structural mesh
 '''
-class StructureMesher(Component):
+class StructureMesher(MemoizationMixin, Component):
 
 
-    def __init__(self, na_unique, node_id, node_id_all):
+    def __init__(self, na_unique, node_id, node_id_all, pass_by_obj=False):
         super(StructureMesher, self).__init__()
 
         #Identification number of the outer surface nodes
@@ -33,7 +37,11 @@ class StructureMesher(Component):
         self.ns_all = len(node_id_all)
 
         #Interpolation matrix G (xs = G xa)
-        self.add_param('G', val=np.zeros((self.ns_all, self.na_unique)))
+        #It can be passed by object (shared by reference, no copies on the data transfers) if its source is too
+        if pass_by_obj:
+            self.add_param('G', val=sparse.csr_matrix((self.ns_all, self.na_unique)), pass_by_obj=True)
+        else:
+            self.add_param('G', val=np.zeros((self.ns_all, self.na_unique)))
 
         #Coordinates of the aerodynamic jig mesh
         self.add_param('apoints_coord_unique', val=np.zeros((self.na_unique, 3)))
@@ -8,7 +8,9 @@ import numpy as np
 
 from openmdao.api import Component
 
-class WingSegmentProps(Component):
+from aerostructures.openmdao_tools.memoization import MemoizationMixin
+
+class WingSegmentProps(MemoizationMixin, Component):
 
     def __init__(self, n_sec):
         super(WingSegmentProps, self).__init__()
@@ -8,8 +8,10 @@ import numpy as np
 
 from openmdao.api import Component
 
+from aerostructures.openmdao_tools.memoization import MemoizationMixin
 
-class XLeadingEdge(Component):
+
+class XLeadingEdge(MemoizationMixin, Component):
 
     def __init__(self, n_sec):
         super(XLeadingEdge, self).__init__()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+
+from __future__ import print_function
+
+import hashlib
+
+import numbers
+
+from collections import OrderedDict
+
+import numpy as np
+
+'''
+Mixin for deterministic components, which skips solve_nonlinear when the params have the same values as in one of the last
+memo_size runs and sets the outputs of that run instead (e.g. on the iterations of a coupled cycle where the component is upstream)
+It must come before the component class in the bases: class MyComponent(MemoizationMixin, Component)
+'''
+class MemoizationMixin(object):
+
+    #Maximum number of stored results (the least recently used one is dropped first, 0 disables the memoization)
+    memo_size = 4
+
+
+    def __init__(self, *args, **kwargs):
+        super(MemoizationMixin, self).__init__(*args, **kwargs)
+
+        #Stored outputs of the last runs, ordered from the least to the most recently used
+        self._memo = OrderedDict()
+
+        #Number of runs skipped and computed
+        self.memo_hits = 0
+        self.memo_misses = 0
+
+        #The memoized solve_nonlinear shadows the one of the component class
+        self.solve_nonlinear = self._memo_solve_nonlinear
+
+
+    #Hash of the params: arrays by value, scalars and strings by representation and other objects (passed by object) by identity
+    def memo_key(self, params):
+        h = hashlib.sha1()
+        for name in sorted(params.keys()):
+            val = params[name]
+            h.update(name.encode())
+            if isinstance(val, np.ndarray) and val.dtype != object:
+                h.update(str((val.dtype.str, val.shape)).encode())
+                h.update(np.ascontiguousarray(val).view(np.uint8))
+            elif isinstance(val, (numbers.Number, str, bool, type(None))):
+                h.update(repr(val).encode())
+            else:
+                h.update(str(id(val)).encode())
+
+        return h.hexdigest()
+
+
+    def _memo_solve_nonlinear(self, params, unknowns, resids):
+
+        key = self.memo_key(params)
+
+        #Set the stored outputs and mark them as the most recently used
+        if key in self._memo:
+            outputs = self._memo.pop(key)
+            self._memo[key] = outputs
+            for name, val in outputs.items():
+                unknowns[name] = val
+            self.memo_hits += 1
+            return
+
+        type(self).solve_nonlinear(self, params, unknowns, resids)
+        self.memo_misses += 1
+
+        #Store copies of the outputs in the vectors, which are overwritten by the next runs
+        if self.memo_size > 0:
+            self._memo[key] = OrderedDict((name, self._memo_value(unknowns, name)) for name in unknowns.keys())
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+
+
+    #Outputs passed by object and read-only arrays are shared with the components that use them,
+    #so they are stored by reference (no second copy, and the same object is set on a memo hit)
+    def _memo_value(self, unknowns, name):
+        val = unknowns[name]
+        if not isinstance(val, np.ndarray) or not val.flags.writeable or unknowns.metadata(name).get('pass_by_obj'):
+            return val
+
+        return np.array(val)
+
+
+    #Remove all the stored results
+    def memo_clear(self):
+        self._memo.clear()
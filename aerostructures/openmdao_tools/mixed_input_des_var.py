@@ -8,10 +8,12 @@ import numpy as np
 
 from openmdao.api import Component
 
+from aerostructures.openmdao_tools.memoization import MemoizationMixin
+
 '''
 Component which combines the thickness and mass design variables with the thicknesses and masses not defined as design variables to create a single input vector for the Nastran components
 '''
-class MixedInputDesvar(Component):
+class MixedInputDesvar(MemoizationMixin, Component):
 
 
     def __init__(self, tn, mn, t_desvar_list=[], m_desvar_list=[]):
@@ -58,8 +60,9 @@ class MixedInputDesvar(Component):
         t_desvar = params['t_desvar']
         m_desvar = params['m_desvar']
 
-        t = t_indep
-        m = m_indep
+        #Copies, so that the params are not modified (they are hashed by the memoization)
+        t = np.array(t_indep)
+        m = np.array(m_indep)
 
         #Substitute the design variables to create the thickness and mass vectors that are the inputs of Nastran components
         for i in range(len(t_desvar_list)):
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+
+from __future__ import print_function
+
+import os
+
+import time
+
+'''
+Waits for the output file of an external code (e.g. written by a solver launched in the background by its wrapper script)
+without spinning: the file is polled with an exponential back-off until it exists, it is newer than the reference file
+(the input file of the run) and its size and modification date have not changed for settle seconds (writing finished)
+Callers that have already waited for the process that writes the file to exit should use settle=0, the file is then complete
+A RuntimeError is raised if the file is not complete after timeout seconds (None: no limit)
+'''
+def wait_for_output(path, newer_than=None, timeout=3600., settle=1., min_interval=0.01, max_interval=1.):
+
+    start = time.time()
+    interval = min_interval
+    last = None
+
+    while True:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+
+        #Only the files written after the reference file are considered
+        if stat is not None and (newer_than is None or stat.st_mtime > os.path.getmtime(newer_than)):
+            current = (stat.st_size, stat.st_mtime)
+            if settle <= 0:
+                return
+            elif current != last:
+                last = current
+                changed = time.time()
+            elif time.time() - changed >= settle:
+                return
+        else:
+            last = None
+
+        if timeout is not None and time.time() - start > timeout:
+            raise RuntimeError("The output file " + str(path) + " was not completed after " + str(timeout) + " s")
+
+        time.sleep(interval)
+        interval = min(2*interval, max_interval)
@@ -12,7 +12,7 @@ from openmdao.api import Component
 class ModalFunctions(Component):
 
 
-    def __init__(self, node_id_all, N, M, mode_tracking=True):
+    def __init__(self, node_id_all, N, M, mode_tracking=True, pass_by_obj=False):
         super(ModalFunctions, self).__init__()
 
         #Identification number of all the structural nodes
@@ -34,7 +34,12 @@ class ModalFunctions(Component):
         self.add_param('phi', val=np.zeros((3*self.ns_all, self.M)))
 
         #Numpy array containing the N refernece normal modes
-        self.add_param('phi_ref', val=np.zeros((3*self.ns_all, self.N)))
+        #It can be passed by object (shared by reference, no copies on the data transfers) if its source is too,
+        #the default value is then a read-only array of zeros without storage
+        if pass_by_obj:
+            self.add_param('phi_ref', val=np.broadcast_to(0., (3*self.ns_all, self.N)), pass_by_obj=True)
+        else:
+            self.add_param('phi_ref', val=np.zeros((3*self.ns_all, self.N)))
 
         #Vector containing the extracted eigenvalues
         self.add_param('eigval', val=np.zeros(M))
@@ -8,8 +8,6 @@ from openmdao.api import ExternalCode
 
 import numpy as np
 
-import os.path
-
 import math
 
 import sys
@@ -18,9 +16,18 @@ from aerostructures.number_formatting.field_writer_8 import print_float_8
 
 from aerostructures.number_formatting.is_number import isint
 
+from aerostructures.openmdao_tools.wait_for_output import wait_for_output
+
 class NastranDynamic(ExternalCode):
     template_file = 'nastran_dynamic_template.inp'
 
+    #Maximum time (s) to wait for the output files of the external code to be completed
+    output_timeout = 3600.
+
+    #Time (s) without changes of the output files before reading them (0: the external code has already exited, so they are complete;
+    #a positive time is only needed if the command launches the solver in the background)
+    output_settle = 0.
+
     output_file = 'nastran_dynamic.out'
 
 
@@ -198,13 +205,9 @@ class NastranDynamic(ExternalCode):
 
         #Read the punch and output files only if they exist and their last modification date is older than input file one
 
-        while(not os.path.isfile(self.output_filepath)): pass
-
-        while(os.path.getmtime(self.output_filepath) <= os.path.getmtime(self.input_filepath)): pass
-
-        while(not os.path.isfile(self.output_file)): pass
+        wait_for_output(self.output_filepath, self.input_filepath, timeout=self.output_timeout, settle=self.output_settle)
 
-        while(os.path.getmtime(self.output_file) <= os.path.getmtime(self.input_filepath)): pass
+        wait_for_output(self.output_file, self.input_filepath, timeout=self.output_timeout, settle=self.output_settle)
 
         phi = np.zeros((3*self.ns_all,self.M))
 
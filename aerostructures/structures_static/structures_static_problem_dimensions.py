@@ -40,6 +40,9 @@ class StaticStructureProblemDimensions:
         #Number of Von Mises stress outputs
         self.n_stress = self.structure_dimensions['n_stress']
 
+        #Connectivity of the skin elements (indices in node_id, -1 as the fourth node of the triangles)
+        self.skin_elements = self.structure_dimensions['skin_elements']
+
 
     #Function that returns the list of node IDs belonging to the outer surface
     def get_structure_dimensions(self):
@@ -51,6 +54,7 @@ class StaticStructureProblemDimensions:
         sn = 0
         an = 0
         n_stress = 0
+        elements = []
 
         #Read the list of nodes belonging to the outer surface from the template file
         with open(self.template_file) as f:
@@ -92,6 +96,8 @@ class StaticStructureProblemDimensions:
                     #Store number of stress outputs (2 stress values per surface, 1 stress value per rod)
                     elif line[0] == 'CTRIA3' or line[0] == 'CQUAD4':
                         n_stress += 2
+                        #Store the grid points of the shell elements
+                        elements.append(line[3:6] if line[0] == 'CTRIA3' else line[3:7])
                     elif line[0] == 'CROD':
                         n_stress += 1
 
@@ -106,6 +112,14 @@ class StaticStructureProblemDimensions:
         node_id_all = [str(node) for node in node_id_all]
         node_id = [str(node) for node in node_id]
 
+        #Connectivity of the shell elements whose grid points all belong to the outer skin
+        node_index = dict((node, i) for i, node in enumerate(node_id))
+        skin_elements = []
+        for element in elements:
+            element = [str(int(node)) for node in element]
+            if all([node in node_index for node in element]):
+                skin_elements.append([node_index[node] for node in element] + [-1]*(4 - len(element)))
+
         #Dictionary containing structure problem data
         structure_dimensions = {}
         structure_dimensions['node_id'] = node_id
@@ -115,5 +129,6 @@ class StaticStructureProblemDimensions:
         structure_dimensions['sn'] = sn
         structure_dimensions['an'] = an
         structure_dimensions['n_stress'] = n_stress
+        structure_dimensions['skin_elements'] = skin_elements
 
         return structure_dimensions
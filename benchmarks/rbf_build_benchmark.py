@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the construction of the interpolation matrix H with Rbf_poly_bias.
+
+Compares the build time, the peak memory and the difference in H between the
+explicit inverse path (solver='inverse') and the factorization based paths
+(solver='lu' and solver='cholesky') on synthetic wing skins of increasing size.
+
+Usage:
+    python rbf_build_benchmark.py [--sizes 500 1000 2000] [--function gaussian]
+"""
+
+from __future__ import print_function
+
+import argparse
+
+import timeit
+
+import tracemalloc
+
+import numpy as np
+
+from aerostructures.data_transfer.rbf_poly_bias import Rbf_poly_bias
+
+
+#Function that returns the number of points along the span and the chord of each surface of a wing skin
+def wing_grid(n_points):
+    n_span = max(2, int(np.sqrt(n_points/2.)*2.))
+    n_chord = max(2, int(n_points/(2.*n_span)))
+
+    return n_span, n_chord
+
+
+#Function that returns the points of a tapered wing skin (upper and lower surfaces)
+def wing_skin(n_points, span=10., root_chord=2., taper=0.4, tc=0.12):
+    n_span, n_chord = wing_grid(n_points)
+
+    s, t = np.meshgrid(np.linspace(0., 1., n_span), 0.5*(1. - np.cos(np.linspace(0., np.pi, n_chord + 2)[1:-1])))
+    s = s.flatten()
+    t = t.flatten()
+
+    chord = root_chord*(1. - (1. - taper)*s)
+    x = 0.5*root_chord*s + t*chord
+    y = span*s
+    z = 2.*tc*chord*np.sqrt(t*(1. - t))
+
+    return np.vstack((np.column_stack((x, y, z)), np.column_stack((x, y, -z))))
+
+
+#Function that returns the connectivity of the quadrilateral elements of the wing skin of wing_skin
+def wing_skin_elements(n_points):
+    n_span, n_chord = wing_grid(n_points)
+
+    idx = np.arange(n_span*n_chord).reshape(n_chord, n_span)
+    quads = np.column_stack((idx[:-1, :-1].ravel(), idx[:-1, 1:].ravel(), idx[1:, 1:].ravel(), idx[1:, :-1].ravel()))
+
+    return np.vstack((quads, quads + n_span*n_chord))
+
+
+#Function that builds H with the given solver and returns the matrix, the elapsed time and the peak memory
+def build(xs, xa, solver, function, epsilon):
+    tracemalloc.start()
+    t0 = timeit.default_timer()
+    H = Rbf_poly_bias(xs[:, 0], xs[:, 1], xs[:, 2], xa[:, 0], xa[:, 1], xa[:, 2],
+                      function=function, epsilon=epsilon, solver=solver).H
+    elapsed = timeit.default_timer() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return H, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the RBF interpolation matrix build')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 1000, 2000, 4000],
+                        help='Number of structural nodes of each case')
+    parser.add_argument('--aero-ratio', type=float, default=2.,
+                        help='Number of aerodynamic points per structural node')
+    parser.add_argument('--function', default='inverse_multiquadric',
+                        help='RBF function type')
+    parser.add_argument('--epsilon', type=float, default=0.5,
+                        help='Epsilon parameter of the RBF functions')
+    args = parser.parse_args()
+
+    solvers = ['inverse', 'lu', 'cholesky']
+
+    print('{:>8} {:>8} {:>10} {:>10} {:>12} {:>12}'.format('ns', 'na', 'solver', 'time (s)', 'peak (MB)', 'max |dH|'))
+
+    for ns in args.sizes:
+        xs = wing_skin(ns)
+        xa = wing_skin(int(args.aero_ratio*ns))
+        xa[:, 2] *= 1.01
+
+        H_ref = None
+        for solver in solvers:
+            try:
+                H, elapsed, peak = build(xs, xa, solver, args.function, args.epsilon)
+            except ValueError as e:
+                print('{:>8} {:>8} {:>10} {}'.format(len(xs), len(xa), solver, e))
+                continue
+
+            if H_ref is None:
+                H_ref = H
+            dH = np.abs(H - H_ref).max()
+
+            print('{:>8} {:>8} {:>10} {:>10.3f} {:>12.1f} {:>12.3e}'.format(len(xs), len(xa), solver, elapsed, peak/1e6, dH))
+
+
+if __name__ == '__main__':
+    main()
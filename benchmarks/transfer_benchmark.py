@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite of the load and displacement transfers.
+
+Builds H with the Interpolation component (Rbf_poly_bias, partition of unity
+or element projection) for several RBF functions and options on synthetic
+wing skins and aerodynamic grids of increasing size, and transfers fields
+with the DisplacementTransfer and LoadTransfer components. For each case, it
+records:
+
+- the build time of H and its peak memory, both as traced by tracemalloc (NumPy
+  and Python allocations) and as the increase of the peak resident set size
+  of the process (which also counts the LAPACK workspaces and the mapped
+  pages of an out-of-core H),
+- the best time of the displacement and load transfers,
+- the relative RMS error of the transfer of a smooth displacement field,
+- the relative errors of the total force and moment after the load transfer.
+
+Each case runs in a new process, so that the peak resident set size is the
+one of the case. With the cache configuration, the build time is the one of
+a cache hit, and the time of the first build (which fills the cache) is also
+recorded.
+
+The results are written to a JSON file (one record per case, with the
+versions of Python, NumPy and SciPy), to track them between releases. Cases
+whose dense matrices would exceed --max-memory, and krylov cases with more
+than --max-krylov structural nodes, are recorded as skipped, and invalid
+combinations (e.g. the sparse solver with a global function) are recorded
+with their error message.
+
+Usage:
+    python transfer_benchmark.py [--sizes 1000 10000 100000] [--functions thin_plate wendland_c2]
+                                 [--configs lu sparse krylov partition_unity projection] [--output results.json]
+"""
+
+from __future__ import print_function
+
+import argparse
+
+import datetime
+
+import json
+
+import multiprocessing
+
+import os
+
+import platform
+
+import shutil
+
+import sys
+
+import tempfile
+
+import timeit
+
+import tracemalloc
+
+from collections import OrderedDict
+
+#resource is not available on Windows, where the peak resident set size is not recorded
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import numpy as np
+
+import scipy
+
+from scipy import sparse
+
+from scipy.spatial import cKDTree
+
+from openmdao.api import Problem, Group, IndepVarComp
+
+from aerostructures.data_transfer.interpolation import Interpolation
+from aerostructures.data_transfer.displacement_transfer import DisplacementTransfer
+from aerostructures.data_transfer.load_transfer import LoadTransfer
+
+from rbf_build_benchmark import wing_skin, wing_skin_elements
+
+
+#Interpolation options of each configuration
+#(the out-of-core file, the cache directory, the surface groups and the number of threads are set by run_case)
+CONFIGS = OrderedDict([
+    ('inverse', {'solver': 'inverse'}),
+    ('lu', {'solver': 'lu'}),
+    ('cholesky', {'solver': 'cholesky'}),
+    ('sparse', {'solver': 'sparse'}),
+    ('krylov', {'solver': 'krylov'}),
+    ('epsilon_auto', {'solver': 'lu', 'epsilon': 'auto'}),
+    ('threads', {'solver': 'lu', 'n_threads': None}),
+    ('reduction', {'solver': 'lu', 'reduction_tol': 1e-4}),
+    ('compression', {'solver': 'lu', 'compression_tol': 1e-6}),
+    ('float32', {'solver': 'lu', 'dtype': np.float32}),
+    ('out_of_core', {'solver': 'lu', 'out_of_core': None}),
+    ('cache', {'solver': 'lu', 'cache_dir': None}),
+    ('surfaces', {'solver': 'lu', 'surfaces': None}),
+    ('partition_unity', {'engine': 'partition_unity'}),
+    ('projection', {'engine': 'projection'}),
+])
+
+#Configurations whose memory grows as ns^2 + na ns
+DENSE_CONFIGS = ('inverse', 'lu', 'cholesky', 'epsilon_auto', 'threads', 'reduction', 'compression', 'float32', 'out_of_core', 'cache', 'surfaces')
+
+#Configurations that do not depend on the RBF function
+FUNCTION_FREE_CONFIGS = ('projection',)
+
+
+#Smooth displacement field used to measure the interpolation error
+def displacement_field(x):
+    xn = x/np.abs(x).max(axis=0)
+    return np.column_stack((np.sin(np.pi*xn[:, 1]), np.cos(2.*xn[:, 0])*xn[:, 1]**2, xn[:, 0]*xn[:, 1] + xn[:, 2]))
+
+
+#Function that returns the best time of repeat runs of a problem
+def best_time(prob, repeat):
+    return min(timeit.repeat(prob.run, number=1, repeat=repeat))
+
+
+#Function that returns the peak resident set size of the process (bytes, None if not available)
+def peak_rss():
+    if resource is None:
+        return None
+
+    #ru_maxrss is in kB on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else 1024*rss
+
+
+#Function that builds H with the Interpolation component and returns it with the build time and peak memories
+def build_h(xs, xa, options):
+    build = Group()
+    build.add('coords', IndepVarComp([('apoints_coord', xa), ('node_coord', xs)]), promotes=['*'])
+    build.add('inter', Interpolation(len(xa), len(xs), pass_by_obj=True, **options), promotes=['*'])
+    prob = Problem(build)
+    prob.setup(check=False)
+
+    rss0 = peak_rss()
+    tracemalloc.start()
+    t0 = timeit.default_timer()
+    prob.run()
+    build_time = timeit.default_timer() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    rss = peak_rss()
+
+    return prob['H'], build_time, peak, None if rss is None else rss - rss0
+
+
+#Function that runs one case and returns its record
+def run_case(xs, xa, elements, config, function, args):
+    na = len(xa)
+    ns = len(xs)
+    options = dict(CONFIGS[config])
+    if options.get('engine') == 'projection':
+        options['elements'] = elements
+    else:
+        options['function'] = function
+
+    #Compactly supported functions take a support radius of a few node spacings
+    if str(function).startswith('wendland') and options.get('engine') != 'projection' and 'epsilon' not in options:
+        spacing = cKDTree(xs).query(xs, 2)[0][:, 1].mean()
+        options['epsilon'] = args.support*spacing
+
+    if 'n_threads' in options:
+        options['n_threads'] = args.threads
+
+    #Independent interpolations of the upper and lower skins
+    if 'surfaces' in options:
+        options['surfaces'] = [(np.flatnonzero(xa[:, 2] >= 0.), np.flatnonzero(xs[:, 2] >= 0.)),
+                               (np.flatnonzero(xa[:, 2] < 0.), np.flatnonzero(xs[:, 2] < 0.))]
+
+    #Out-of-core file and cache in a temporary directory, removed after the case
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        if 'out_of_core' in options:
+            options['out_of_core'] = os.path.join(tmp_dir, 'H.npy')
+
+        #The first build fills the cache, the second one (measured) reads H from it
+        fill_time = None
+        if 'cache_dir' in options:
+            options['cache_dir'] = tmp_dir
+            fill_time = build_h(xs, xa, options)[1]
+
+        H, build_time, peak, rss = build_h(xs, xa, options)
+
+        transfers = run_transfers(xs, xa, H, args)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    record = OrderedDict([('build_time', build_time), ('peak_memory', peak), ('peak_rss', rss)])
+    if fill_time is not None:
+        record['cache_fill_time'] = fill_time
+    record.update(transfers)
+
+    return record
+
+
+#Function that runs the displacement and load transfers with H and returns their times and errors
+def run_transfers(xs, xa, H, args):
+    na = len(xa)
+    ns = len(xs)
+
+    #Displacement transfer of a smooth field (and of several load cases if required)
+    shape = (args.cases,) if args.cases > 1 else ()
+    n_cases = args.cases if args.cases > 1 else None
+    u_s = displacement_field(xs)
+    u_a = displacement_field(xa)
+
+    disp = Group()
+    disp.add('matrix', IndepVarComp('H', sparse.csr_matrix((na, ns)), pass_by_obj=True), promotes=['*'])
+    disp.add('field', IndepVarComp('u', np.broadcast_to(u_s, shape + u_s.shape).copy()), promotes=['*'])
+    disp.add('transfer', DisplacementTransfer(na, ns, pass_by_obj=True, n_cases=n_cases), promotes=['*'])
+    #OpenMDAO checks that the objects of a connection have the same type as declared, so H is set after the setup
+    prob = Problem(disp)
+    prob.setup(check=False)
+    prob['H'] = H
+    disp_time = best_time(prob, args.repeat)
+    delta = np.asarray(prob['delta']).reshape(shape + (na, 3))
+    if args.cases > 1:
+        delta = delta[0]
+    interp_error = np.sqrt(((delta - u_a)**2).mean()/(u_a**2).mean())
+
+    #Load transfer of random aerodynamic forces
+    f_a = np.random.RandomState(0).randn(na, 3)
+
+    load = Group()
+    load.add('matrix', IndepVarComp('H', sparse.csr_matrix((na, ns)), pass_by_obj=True), promotes=['*'])
+    load.add('field', IndepVarComp('f_a', np.broadcast_to(f_a, shape + f_a.shape).copy()), promotes=['*'])
+    load.add('transfer', LoadTransfer(na, ns, pass_by_obj=True, n_cases=n_cases), promotes=['*'])
+    prob = Problem(load)
+    prob.setup(check=False)
+    prob['H'] = H
+    load_time = best_time(prob, args.repeat)
+    f_s = np.asarray(prob['f_node']).reshape(shape + (ns, 3))
+    if args.cases > 1:
+        f_s = f_s[0]
+
+    force = f_a.sum(axis=0)
+    moment = np.cross(xa, f_a).sum(axis=0)
+    force_error = np.linalg.norm(f_s.sum(axis=0) - force)/np.linalg.norm(force)
+    moment_error = np.linalg.norm(np.cross(xs, f_s).sum(axis=0) - moment)/np.linalg.norm(moment)
+
+    return OrderedDict([('displacement_time', disp_time), ('load_time', load_time),
+                        ('interpolation_error', float(interp_error)), ('force_error', float(force_error)), ('moment_error', float(moment_error))])
+
+
+#Function that runs one case in a new process, so that the peak resident set size is the one of the case
+def run_case_process(xs, xa, elements, config, function, args):
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(run_case, (xs, xa, elements, config, function, args))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark suite of the load and displacement transfers')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 3000, 10000, 30000, 100000],
+                        help='Number of structural nodes of each case')
+    parser.add_argument('--aero-ratio', type=float, default=2.,
+                        help='Number of aerodynamic points per structural node')
+    parser.add_argument('--functions', nargs='+', default=['thin_plate', 'multiquadric', 'inverse_multiquadric', 'wendland_c2'],
+                        help='RBF function types')
+    parser.add_argument('--configs', nargs='+', default=list(CONFIGS), choices=list(CONFIGS),
+                        help='Interpolation configurations')
+    parser.add_argument('--support', type=float, default=8.,
+                        help='Support radius of the compactly supported functions, in mean node spacings')
+    parser.add_argument('--cases', type=int, default=1,
+                        help='Number of load cases of the transfers')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of repetitions of the transfers (the best time is kept)')
+    parser.add_argument('--max-memory', type=float, default=4.,
+                        help='Maximum memory (GB) of the dense matrices of a case')
+    parser.add_argument('--max-krylov', type=int, default=20000,
+                        help='Maximum number of structural nodes of the krylov cases (each transfer runs GMRES)')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='Number of threads of the threads configuration')
+    parser.add_argument('--output', default='transfer_benchmark.json',
+                        help='JSON file of the results')
+    args = parser.parse_args()
+
+    results = OrderedDict([('date', datetime.datetime.now().isoformat()), ('python', platform.python_version()),
+                           ('numpy', np.__version__), ('scipy', scipy.__version__), ('platform', platform.platform()),
+                           ('arguments', vars(args)), ('cases', [])])
+
+    print('{:>8} {:>8} {:>16} {:>22} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format('ns', 'na', 'config', 'function', 'build (s)', 'peak (MB)', 'RSS (MB)',
+                                                                                              'disp (s)', 'load (s)', 'interp', 'moment'))
+
+    for size in args.sizes:
+        xs = wing_skin(size)
+        xa = wing_skin(int(args.aero_ratio*size))
+        xa[:, 2] *= 1.01
+        elements = wing_skin_elements(size)
+        ns = len(xs)
+        na = len(xa)
+
+        for config in args.configs:
+            functions = [None] if config in FUNCTION_FREE_CONFIGS else args.functions
+            for function in functions:
+                record = OrderedDict([('ns', ns), ('na', na), ('config', config), ('function', function)])
+
+                dense_memory = 8.*(na*ns + 2.*(ns + 4)**2)
+                if config in DENSE_CONFIGS and dense_memory > args.max_memory*2**30:
+                    record['status'] = 'skipped'
+                    record['message'] = 'dense matrices of {:.1f} GB'.format(dense_memory/2**30)
+                elif config == 'krylov' and ns > args.max_krylov:
+                    record['status'] = 'skipped'
+                    record['message'] = 'more than {} structural nodes for the krylov solver'.format(args.max_krylov)
+                else:
+                    try:
+                        record.update(run_case_process(xs, xa, elements, config, function, args))
+                        record['status'] = 'ok'
+                    except (ValueError, MemoryError, RuntimeError) as e:
+                        record['status'] = 'error'
+                        record['message'] = str(e)
+
+                results['cases'].append(record)
+
+                if record['status'] == 'ok':
+                    rss = float('nan') if record['peak_rss'] is None else record['peak_rss']/1e6
+                    print('{:>8} {:>8} {:>16} {:>22} {:>10.3f} {:>10.1f} {:>10.1f} {:>10.4f} {:>10.4f} {:>10.2e} {:>10.2e}'.format(ns, na, config, str(function), record['build_time'],
+                          record['peak_memory']/1e6, rss, record['displacement_time'], record['load_time'], record['interpolation_error'], record['moment_error']))
+                else:
+                    print('{:>8} {:>8} {:>16} {:>22} {}: {}'.format(ns, na, config, str(function), record['status'], record['message']))
+
+                #Write the results after each case, so that a long run can be interrupted
+                with open(args.output, 'w') as f:
+                    json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
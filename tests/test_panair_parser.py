@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Regression tests of the Panair output parser (Panair.read_output).
+
+The expected values are the outputs of the previous parser (readlines and
+lines.index) on data/panair.out, which has two networks (3x3 and 2x3 points),
+two identical panels, numbered lines that are not panels and a second forces
+and moments summary after the one of the full configuration.
+"""
+
+from __future__ import print_function
+
+import os
+
+import numpy as np
+
+import pytest
+
+from aerostructures.aerodynamics.panair import Panair
+
+
+OUTPUT_FILE = os.path.join(os.path.dirname(__file__), 'data', 'panair.out')
+
+#Networks of the aerodynamic mesh (network ID, rows, columns and number of points and panels of preceding networks)
+NETWORK_INFO = [[1, 3, 3, 0, 0], [2, 2, 3, 9, 4]]
+
+#Cp and normal vector of each panel given by the previous parser
+PAN_CP = [[-0.5123, 0.01, 0.02, 0.99],
+          [-0.4321, 0.011, 0.021, 0.98],
+          [0.1234, 0.012, 0.022, 0.97],
+          [0.1234, 0.012, 0.022, 0.97],
+          [0.25, -0.01, 0.03, -0.99],
+          [0.3125, -0.011, 0.031, -0.98]]
+
+#Lift and induced drag coefficients given by the previous parser (as strings)
+CL = '0.412345'
+CDi = '0.009876'
+
+
+def read(network_info=NETWORK_INFO):
+    panair = Panair(sum([n[1]*n[2] for n in network_info]), network_info, 'case')
+    with open(OUTPUT_FILE) as f:
+        return panair.read_output(f)
+
+
+def test_panels():
+    pan_cp = read()[0]
+
+    assert isinstance(pan_cp, np.ndarray)
+    assert pan_cp.shape == (6, 4)
+    np.testing.assert_array_equal(pan_cp, PAN_CP)
+
+
+def test_duplicate_panels():
+    pan_cp = read()[0]
+
+    np.testing.assert_array_equal(pan_cp[2], pan_cp[3])
+
+
+def test_coefficients_of_first_summary():
+    CL_out, CDi_out = read()[1:]
+
+    assert CL_out == float(CL)
+    assert CDi_out == float(CDi)
+
+
+def test_more_panels_than_networks():
+    with pytest.raises(ValueError):
+        read([[1, 3, 3, 0, 0]])
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Regression tests of the derivatives of the RBF interpolation matrix
+(Rbf_poly_bias.jvp and Rbf_poly_bias.vjp).
+
+jvp is compared with central finite differences of H rebuilt on perturbed
+coordinates of a small random mesh, and vjp with jvp through the dot-product
+identity <jvp(dxs, dxa), W> = <dxs, xs_bar> + <dxa, xa_bar>, (xs_bar, xa_bar) = vjp(W).
+"""
+
+from __future__ import print_function
+
+import numpy as np
+
+import pytest
+
+from aerostructures.data_transfer.rbf_poly_bias import Rbf_poly_bias
+
+
+#Structural nodes and aerodynamic points of the random mesh (3 x N)
+XS = np.random.RandomState(0).rand(3, 12)
+XA = np.random.RandomState(1).rand(3, 7)
+
+#Options of the interpolation: function, solver, norm bias and epsilon (None: default epsilon, which depends on the nodes)
+CASES = [('multiquadric', 'inverse', None, None),
+         ('multiquadric', 'lu', [1., 2., 0.5], None),
+         ('thin_plate', 'inverse', [1., 2., 0.5], 0.7),
+         ('gaussian', 'lu', None, 0.7)]
+
+
+def build(xs, xa, function, solver, bias, epsilon):
+    kwargs = {'function': function, 'solver': solver}
+    if bias is not None:
+        kwargs['bias'] = bias
+    if epsilon is not None:
+        kwargs['epsilon'] = epsilon
+    return Rbf_poly_bias(*(list(xs) + list(xa)), **kwargs)
+
+
+@pytest.mark.parametrize('function, solver, bias, epsilon', CASES)
+def test_jvp_finite_differences(function, solver, bias, epsilon):
+    rbf = build(XS, XA, function, solver, bias, epsilon)
+    rng = np.random.RandomState(2)
+    dxs = rng.rand(*XS.shape) - 0.5
+    dxa = rng.rand(*XA.shape) - 0.5
+
+    #Central finite differences of H
+    h = 1e-6
+    H_p = build(XS + h*dxs, XA + h*dxa, function, solver, bias, epsilon).H
+    H_m = build(XS - h*dxs, XA - h*dxa, function, solver, bias, epsilon).H
+    dH_fd = (H_p - H_m)/(2*h)
+
+    dH = rbf.jvp(dxs, dxa)
+
+    assert dH.shape == rbf.H.shape
+    np.testing.assert_allclose(dH, dH_fd, rtol=1e-5, atol=1e-6*abs(dH_fd).max())
+
+
+@pytest.mark.parametrize('function, solver, bias, epsilon', CASES)
+def test_jvp_of_each_coordinate_set(function, solver, bias, epsilon):
+    rbf = build(XS, XA, function, solver, bias, epsilon)
+    rng = np.random.RandomState(2)
+    dxs = rng.rand(*XS.shape) - 0.5
+    dxa = rng.rand(*XA.shape) - 0.5
+
+    np.testing.assert_allclose(rbf.jvp(dxs, None) + rbf.jvp(None, dxa), rbf.jvp(dxs, dxa), atol=1e-12)
+
+
+@pytest.mark.parametrize('function, solver, bias, epsilon', CASES)
+def test_dot_product_identity(function, solver, bias, epsilon):
+    rbf = build(XS, XA, function, solver, bias, epsilon)
+    rng = np.random.RandomState(2)
+    dxs = rng.rand(*XS.shape) - 0.5
+    dxa = rng.rand(*XA.shape) - 0.5
+    W = rng.rand(*rbf.H.shape) - 0.5
+
+    xs_bar, xa_bar = rbf.vjp(W)
+
+    assert xs_bar.shape == XS.shape
+    assert xa_bar.shape == XA.shape
+    lhs = np.sum(rbf.jvp(dxs, dxa)*W)
+    rhs = np.sum(dxs*xs_bar) + np.sum(dxa*xa_bar)
+    assert lhs == pytest.approx(rhs, rel=1e-10)